@@ -4,12 +4,12 @@ Actor Agent
 演员 Agent - 负责扮演特定角色并审核剧本
 """
 
-import json
 import logging
 from typing import Dict, Any, Optional, List
 from .llm_client import LLMClient
 
 from .config import ActorConfig
+from .utils import JSONParser
 
 logger = logging.getLogger(__name__)
 
@@ -169,7 +169,7 @@ class ActorAgent:
         prompt = self.config.EXPRESSION_DESCRIPTION_PROMPT.format(
             name=self.name,
             expression=expression_name,
-            character_info=json.dumps(self.character_info, ensure_ascii=False, indent=2)
+            character_info=JSONParser.dumps(self.character_info, indent=False)
         )
         
         system_prompt = self.config.SYSTEM_PROMPT.format(
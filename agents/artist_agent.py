@@ -2,6 +2,9 @@ import os
 import logging
 import base64
 import hashlib
+import io
+import re
+import threading
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 import json
@@ -12,6 +15,9 @@ from .config import APIConfig, ArtistConfig, PathConfig
 
 logger = logging.getLogger(__name__)
 
+# 背景文件名中不允许出现的字符
+_UNSAFE_FILENAME_CHARS_RE = re.compile(r'[^\w\s-]')
+
 
 class ArtistAgent:
     """美术 Agent - 角色立绘生成器（支持 OpenAI GPT Image 和 Google Imagen）"""
@@ -24,12 +30,15 @@ class ArtistAgent:
             api_key: API Key
             base_url: API Base URL
         """
+        PathConfig.ensure_directories()
         self.provider = APIConfig.IMAGE_PROVIDER.lower()
         self.api_key = api_key
         self.base_url = base_url
         self.config = ArtistConfig
         self.client = None
         self.available = False
+        self._http_session = None  # 下载图片 URL 时复用的连接池，首次使用时创建
+        self._http_session_lock = threading.Lock()  # 立绘并行生成时避免重复创建会话
         
         self._initialize_client()
         
@@ -74,6 +83,25 @@ class ArtistAgent:
         else:
             logger.error(f"❌ 不支持的图像生成提供商: {self.provider}")
     
+    def _get_http_session(self):
+        """获取复用的 HTTP 会话（keep-alive，避免每次下载重新建立 TLS 连接）"""
+        with self._http_session_lock:
+            if self._http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=8,
+                    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._http_session = session
+            return self._http_session
+    
     def generate_character_images(
         self,
         character: Dict[str, Any],
@@ -246,8 +274,9 @@ class ArtistAgent:
                 if hasattr(data, 'b64_json') and data.b64_json:
                     return base64.b64decode(data.b64_json)
                 elif hasattr(data, 'url') and data.url:
-                    import requests
-                    return requests.get(data.url).content
+                    response = self._get_http_session().get(data.url, timeout=60)
+                    response.raise_for_status()
+                    return response.content
                     
                 return None
 
@@ -283,7 +312,6 @@ class ArtistAgent:
                     # 如果 part.as_image() 返回 PIL Image
                     try:
                         img = part.as_image()
-                        import io
                         buf = io.BytesIO()
                         img.save(buf, format='PNG')
                         return buf.getvalue()
@@ -293,9 +321,16 @@ class ArtistAgent:
         return None
 
     def _save_image(self, image_data: bytes, filepath: Path) -> None:
-        """保存图像数据到文件"""
-        with open(filepath, 'wb') as f:
+        """
+        保存图像数据到文件
+        
+        先写入临时文件再原子替换：中途中断不会留下半截 PNG，
+        否则下次运行会因文件已存在而跳过重新生成
+        """
+        tmp_path = filepath.with_name(filepath.name + ".part")
+        with open(tmp_path, 'wb') as f:
             f.write(image_data)
+        os.replace(tmp_path, filepath)
         logger.info(f"   ✅ 图像保存成功: {filepath}")
     
 
@@ -320,7 +355,9 @@ class ArtistAgent:
                 alpha_matting_base_size=0  # 保持原始分辨率
             )
             
-            output_image.save(filepath)
+            tmp_path = filepath.with_name(filepath.name + ".part")
+            output_image.save(tmp_path, format='PNG')
+            os.replace(tmp_path, filepath)
             logger.info(f"   ✅ 背景移除成功")
         except Exception as e:
             logger.error(f"   ❌ 背景移除失败: {e}")
@@ -393,8 +430,7 @@ class ArtistAgent:
         logger.info(f"🖼️  开始生成场景背景: {location}")
         
         # 生成文件名（提前检查）
-        import re
-        safe_location = re.sub(r'[^\w\s-]', '', location).strip().replace(' ', '_')
+        safe_location = _UNSAFE_FILENAME_CHARS_RE.sub('', location).strip().replace(' ', '_')
         
         # 如果指定了时间段，则加后缀；否则直接用地点名
         if time_of_day:
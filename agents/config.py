@@ -4,8 +4,11 @@ Agent Configuration
 所有 Agent 的配置、API Keys、模型参数和 Prompt 模板
 """
 
+import functools
 import os
-from typing import Dict, Any
+import sys
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple
 from pathlib import Path
 
 # 加载 .env 文件
@@ -23,25 +26,34 @@ except ImportError:
     print("   请运行: pip install python-dotenv")
 
 # ==================== API 配置 ====================
-class APIConfig:
+@dataclass(frozen=True, slots=True)
+class _APIConfig:
     """API 密钥配置"""
     # 提供商配置
-    TEXT_PROVIDER = os.getenv("TEXT_PROVIDER", "google")
-    IMAGE_PROVIDER = os.getenv("IMAGE_PROVIDER", "google")
+    TEXT_PROVIDER: str = os.getenv("TEXT_PROVIDER", "google")
+    IMAGE_PROVIDER: str = os.getenv("IMAGE_PROVIDER", "google")
     
     # OpenAI API (用于 GPT-4 和图像生成)
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     
     # Google Gemini API
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
-    GOOGLE_BASE_URL = os.getenv("GOOGLE_BASE_URL", "")
+    GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
+    GOOGLE_BASE_URL: str = os.getenv("GOOGLE_BASE_URL", "")
 
     # 模型名称
-    MODEL = os.getenv("MODEL", "gemini-3-pro-preview")
+    MODEL: str = os.getenv("MODEL", "gemini-3-pro-preview")
     
     # 图像生成模型
-    IMAGE_MODEL = os.getenv("IMAGE_MODEL", "gpt-image-1.5") 
+    IMAGE_MODEL: str = os.getenv("IMAGE_MODEL", "gpt-image-1.5") 
+    
+    # 同时进行中的文本 LLM 请求上限（所有 Agent、所有线程共享），避免并行写作节点时触发限流
+    MAX_CONCURRENT_LLM_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_LLM_REQUESTS", "4"))
+    
+    # LLM 响应缓存目录（留空则不缓存）
+    LLM_CACHE_DIR: str = os.getenv("LLM_CACHE_DIR", "")
+
+APIConfig = _APIConfig()
 
 
 # ==================== 全局常量 ====================
@@ -49,20 +61,21 @@ class APIConfig:
 STANDARD_EXPRESSIONS = os.getenv("GAME_CHARACTER_EXPRESSIONS", "neutral").split(",")
 
 # ==================== 策划 (Designer) Agent 配置 ====================
-class DesignerConfig:
+@dataclass(frozen=True, slots=True)
+class _DesignerConfig:
     """策划 Agent - 负责草拟游戏设计文档"""
     
     # 游戏内容配置
-    TOTAL_NODES = int(os.getenv("GAME_TOTAL_NODES", "12"))
-    DEFAULT_CHARACTER_COUNT = int(os.getenv("GAME_CHARACTER_COUNT", "3"))
-    PLOT_SEGMENTS_PER_NODE = int(os.getenv("PLOT_SEGMENTS_PER_NODE", "3"))
+    TOTAL_NODES: int = int(os.getenv("GAME_TOTAL_NODES", "12"))
+    DEFAULT_CHARACTER_COUNT: int = int(os.getenv("GAME_CHARACTER_COUNT", "3"))
+    PLOT_SEGMENTS_PER_NODE: int = int(os.getenv("PLOT_SEGMENTS_PER_NODE", "3"))
 
-    SYSTEM_PROMPT = f"""你是一位资深的 Visual Novel (视觉小说) 策划，擅长创作引人入胜的故事。
+    SYSTEM_PROMPT: str = f"""你是一位资深的 Visual Novel (视觉小说) 策划，擅长创作引人入胜的故事。
 你的任务是设计一个完整的 Visual Novel 游戏文档，采用**有向无环图（DAG）结构**，允许不同分支分离并汇合，并确保所有角色在复杂的剧情网中都有精彩的表现。
 """
 
 
-    GAME_DESIGN_PROMPT = """请创作一个 Visual Novel 游戏设计文档。
+    GAME_DESIGN_PROMPT: str = """请创作一个 Visual Novel 游戏设计文档。
 
 角色数量：{character_count} (包含主角)
 剧情结构：有向无环图（DAG），支持多分支和路径汇合
@@ -130,13 +143,6 @@ class DesignerConfig:
       {{"from": "node4", "to": "node5", "choice_text": "公开真相"}},
       {{"from": "node4", "to": "node6", "choice_text": "接受虚假的安宁"}}
     ]
-    
-    **【choice_text 规范】**：
-    - **choice_text 为 null**：表示自动前进，不显示选项（适用于单一路径的自然延续）
-    - **choice_text 有值**：必须是简洁的、沉浸式的选项文本（10字以内）
-    - **严禁出戏标记**：不要在选项中加入元标记，如"(技术路线)"、"【武力路线】"、"[BRANCH A]"等
-    - **错误示例**：❌ "联系黑客金克丝 (技术路线)"、❌ "【理性选择】寻求帮助"
-    - **正确示例**：✅ "联系黑客金克丝"、✅ "寻求帮助"、✅ "独自调查"
   }},
   "characters": [
     {{
@@ -172,7 +178,7 @@ class DesignerConfig:
 4. **choice_text 规范（重要！）**：
    - **null 值**：表示自动前进，无需玩家选择（单一路径延续）
    - **有值**：必须是简洁沉浸的选项文本（5-10字），直接描述行动
-   - **严禁元标记**：不要加括号注释、路线标识、分支标记等破坏沉浸感的内容
+   - **严禁元标记**：不要加括号注释、路线标识（如"(技术路线)"、"【武力路线】"、"[BRANCH A]"）等破坏沉浸感的内容
    - 错误示例：❌ "联系金克丝 (技术路线)"、❌ "【理性】寻求帮助"
    - 正确示例：✅ "联系金克丝"、✅ "寻求帮助"、✅ "独自调查"
 5. **节点ID命名规范**：使用统一的 node + 数字 格式
@@ -200,18 +206,21 @@ class DesignerConfig:
 11. 确保所有角色在不同分支中都有合理的出场机会"""
 
     # 模型参数
-    TEMPERATURE = 0.7
-    MAX_TOKENS = 20000
+    TEMPERATURE: float = 0.7
+    MAX_TOKENS: int = 20000
+
+DesignerConfig = _DesignerConfig()
 
 
 # ==================== 制作人 (Producer) Agent 配置 ====================
-class ProducerConfig:
+@dataclass(frozen=True, slots=True)
+class _ProducerConfig:
     """制作人 Agent - 负责审核游戏设计文档并把控进度"""
     
-    SYSTEM_PROMPT = """你是一位资深的 Visual Novel 游戏制作人，负责把控游戏的宏观质量和项目方向。
+    SYSTEM_PROMPT: str = """你是一位资深的 Visual Novel 游戏制作人，负责把控游戏的宏观质量和项目方向。
 你的任务是审核策划提交的设计方案，确保其符合用户需求，且具有商业价值和艺术逻辑。"""
 
-    GAME_DESIGN_CRITIQUE_PROMPT = """你现在是游戏制作人，请审核以下由策划草拟的游戏设计文档。
+    GAME_DESIGN_CRITIQUE_PROMPT: str = """你现在是游戏制作人，请审核以下由策划草拟的游戏设计文档。
 
 【用户原始要求】
 {user_requirements}
@@ -233,17 +242,23 @@ class ProducerConfig:
 - 如果认为指标合格且方案可以直接投入正式开发，请只回复 "PASS"。
 - 如果指标不符或认为需要改进，请提供具体且专业且一针见血的详细修改建议。"""
 
+ProducerConfig = _ProducerConfig()
+
 
 
 # ==================== 美术 Agent 配置 ====================
-class ArtistConfig:
+@dataclass(frozen=True, slots=True)
+class _ArtistConfig:
     """美术 Agent - 负责生成角色立绘"""
     
     # 标准表情列表
-    STANDARD_EXPRESSIONS = os.getenv("GAME_CHARACTER_EXPRESSIONS", "neutral").split(",")
+    STANDARD_EXPRESSIONS: Tuple[str, ...] = tuple(os.getenv("GAME_CHARACTER_EXPRESSIONS", "neutral").split(","))
+    
+    # 互不依赖的角色立绘最多并行生成的数量，设为 1 则逐张生成
+    MAX_PARALLEL_IMAGES: int = int(os.getenv("MAX_PARALLEL_IMAGES", "4"))
     
     # 角色立绘提示词模板
-    IMAGE_PROMPT_TEMPLATE = """A single anime character portrait in vertical orientation for a visual novel game.
+    IMAGE_PROMPT_TEMPLATE: str = """A single anime character portrait in vertical orientation for a visual novel game.
 
 Story Context: {story_background}
 Art Style: {art_style}
@@ -274,14 +289,14 @@ Art style: High quality Japanese anime/manga style, beautiful detailed eyes, det
 This is a character sprite for a visual novel game."""
     
     # 图像生成参数（角色立绘）
-    IMAGE_SIZE = "1024x1792"  # 竖版，适合立绘
-    IMAGE_WIDTH = 1024
-    IMAGE_HEIGHT = 1792
-    IMAGE_QUALITY = "standard"  # "standard" 或 "hd"
-    IMAGE_STYLE = "vivid"  # "vivid" 或 "natural"
+    IMAGE_SIZE: str = "1024x1792"  # 竖版，适合立绘
+    IMAGE_WIDTH: int = 1024
+    IMAGE_HEIGHT: int = 1792
+    IMAGE_QUALITY: str = "standard"  # "standard" 或 "hd"
+    IMAGE_STYLE: str = "vivid"  # "vivid" 或 "natural"
     
     # 场景背景图配置（参考 AI-GAL-main 的高质量背景 prompt）
-    BACKGROUND_PROMPT_TEMPLATE = """masterpiece, wallpaper, 8k, detailed CG, {location}, {atmosphere}, {time_of_day}, (no_human)
+    BACKGROUND_PROMPT_TEMPLATE: str = """masterpiece, wallpaper, 8k, detailed CG, {location}, {atmosphere}, {time_of_day}, (no_human)
 
 Story Context: {story_background}
 Art Style: {art_style}
@@ -292,14 +307,14 @@ Wide establishing shot, environment only, professional game CG quality.
 
 AVOID: people, characters, text, watermark, low quality, cropped, blurry, bad composition"""
 
-    BACKGROUND_SIZE = "1792x1024"  # 横版，适合背景
-    BACKGROUND_WIDTH = 1792
-    BACKGROUND_HEIGHT = 1024
-    BACKGROUND_QUALITY = "standard"
-    BACKGROUND_STYLE = "vivid"
+    BACKGROUND_SIZE: str = "1792x1024"  # 横版，适合背景
+    BACKGROUND_WIDTH: int = 1792
+    BACKGROUND_HEIGHT: int = 1024
+    BACKGROUND_QUALITY: str = "standard"
+    BACKGROUND_STYLE: str = "vivid"
 
     # 标题画面 Prompt
-    TITLE_IMAGE_PROMPT_TEMPLATE = """A masterpiece, high-quality title screen illustration for a visual novel game.
+    TITLE_IMAGE_PROMPT_TEMPLATE: str = """A masterpiece, high-quality title screen illustration for a visual novel game.
 
 Game Title: {title}
 Theme/Setting: {background}
@@ -311,12 +326,22 @@ Wide aspect ratio (16:9).
 
 AVOID: text, watermark, low quality, cropped, blurry, bad composition"""
 
+ArtistConfig = _ArtistConfig()
+
 
 # ==================== 编剧 Agent 配置 ====================
-class WriterConfig:
+@dataclass(frozen=True, slots=True)
+class _WriterConfig:
     """编剧 Agent - 负责生成剧情节点"""
     
-    SYSTEM_PROMPT = f"""你是一位经验丰富的 Visual Novel 编剧，擅长创作细腻的对话和引人入胜的剧情。
+    # 同一层级（互不依赖）的剧情节点最多并行生成的数量，设为 1 则逐个生成
+    MAX_PARALLEL_NODES: int = int(os.getenv("MAX_PARALLEL_NODES", "3"))
+    
+    # 角色信息文本的总字符预算（导演每轮对话都会发送），按角色数均分，每人至少 CHARACTER_INFO_MIN_CHARS
+    CHARACTER_INFO_MAX_CHARS: int = 1200
+    CHARACTER_INFO_MIN_CHARS: int = 120
+    
+    SYSTEM_PROMPT: str = f"""你是一位经验丰富的 Visual Novel 编剧，擅长创作细腻的对话和引人入胜的剧情。
 你的任务是根据游戏设计文档和当前剧情节点的大纲，生成该节点的详细剧情脚本。
 
 剧情要求：
@@ -331,7 +356,7 @@ class WriterConfig:
 5. **重要：场景地点只能使用游戏设计中预定义的场景，不能自创新场景**
 6. **直接输出剧本内容，不要包含任何思考过程或解释性文字**"""
 
-    PLOT_SPLIT_PROMPT = """你是一位专业的编剧。请将以下剧情节点概要切分成 {segment_count} 个具体的"剧情片段" (Plot Points)。
+    PLOT_SPLIT_PROMPT: str = """你是一位专业的编剧。请将以下剧情节点概要切分成 {segment_count} 个具体的"剧情片段" (Plot Points)。
 {split_instruction}
 
 【节点概要】
@@ -359,7 +384,7 @@ class WriterConfig:
 
 注意：每个片段的 characters 数组中的角色名必须与【可用角色列表】完全一致。"""
 
-    PLOT_SYNTHESIS_PROMPT = """你是一位专业的 Visual Novel 编剧。你的任务是将以下由 AI 演员演绎的剧情片段（JSON 格式日志）整合成一份文学性强、代入感深的 Visual Novel 剧本。
+    PLOT_SYNTHESIS_PROMPT: str = """你是一位专业的 Visual Novel 编剧。你的任务是将以下由 AI 演员演绎的剧情片段（JSON 格式日志）整合成一份文学性强、代入感深的 Visual Novel 剧本。
 
 【剧情片段演绎记录 (JSON)】
 {plot_performances}
@@ -420,7 +445,7 @@ class WriterConfig:
 
 直接输出最终剧本，不要包含任何解释性文字。"""
 
-    NEXT_SPEAKER_PROMPT = """你是指挥整场戏的导演。
+    NEXT_SPEAKER_PROMPT: str = """你是指挥整场戏的导演。
 【当前剧情片段目标】
 {plot_summary}
 
@@ -449,7 +474,7 @@ class WriterConfig:
 注意你只能选择在场角色中的一位作为下一发言者，不能选择旁白或者其他角色。
 注意保持整体剧情的完整性和连贯性。"""
 
-    SUMMARY_PROMPT = """请为以下剧情生成一个简短的摘要（Summary），用于作为后续剧情的"前情提要"。
+    SUMMARY_PROMPT: str = """请为以下剧情生成一个简短的摘要（Summary），用于作为后续剧情的"前情提要"。
 
 【剧情内容】
 {story_content}
@@ -460,15 +485,36 @@ class WriterConfig:
 3. 长度控制在 200 字以内。
 4. 直接输出摘要内容。"""
 
+    # 不超过该长度（字符）的剧情直接作为摘要使用，不再调用 LLM 压缩
+    SUMMARY_MIN_LENGTH: int = 300
+    
+    # 一次请求中批量生成摘要的剧情段数
+    SUMMARY_BATCH_SIZE: int = 8
+    
+    # 内存中保留的剧情摘要条数（按剧情内容哈希缓存）
+    SUMMARY_CACHE_SIZE: int = 256
+
+    SUMMARY_BATCH_PROMPT: str = """请为以下 {count} 段剧情分别生成简短的摘要（Summary），用于作为后续剧情的"前情提要"。
+
+{sections}
+
+要求：
+1. 每段摘要概括主要事件和关键对话，包含任何重要的伏笔或状态变化。
+2. 每段摘要长度控制在 200 字以内，各段独立总结，不要混合其他段落的内容。
+3. 严格输出 JSON 数组，每段一个元素，格式为：[{{"id": 段落编号, "summary": "摘要内容"}}, ...]"""
+
+WriterConfig = _WriterConfig()
+
 
 # ==================== 演员 Agent 配置 ====================
-class ActorConfig:
+@dataclass(frozen=True, slots=True)
+class _ActorConfig:
     """演员 Agent - 负责扮演特定角色并审核剧本"""
     
     # 模型参数
-    TEMPERATURE = 0.7
+    TEMPERATURE: float = 0.7
     
-    SYSTEM_PROMPT = """你现在是 Visual Novel 游戏中的角色 "{name}"。
+    SYSTEM_PROMPT: str = """你现在是 Visual Novel 游戏中的角色 "{name}"。
 
 【你的设定】
 性格：{personality}
@@ -477,7 +523,7 @@ class ActorConfig:
 你需要沉浸在角色中，以第一人称思考和行动，但不要脸谱化和过分体现人物性格，只确保人物不要OOC即可。
 请忘记你是一个 AI 模型，你就是这个角色。"""
 
-    PERFORM_PROMPT = """请根据以下剧情片段的大纲，以及当前的对话记录，继续演绎你在其中的台词和动作。
+    PERFORM_PROMPT: str = """请根据以下剧情片段的大纲，以及当前的对话记录，继续演绎你在其中的台词和动作。
 
 【剧情片段】
 {plot_summary}
@@ -506,7 +552,7 @@ class ActorConfig:
    - **如果且现有立绘均无法代表你此刻的心情，则你需要新的立绘，请创造新的表情名来更好地表达你自己。**
    - **表情名必须是完整的英文单词（例如 'angry', 'surprised'），严禁使用单字母缩写（如 't', 'a'）或中文。**"""
 
-    IMAGE_CRITIQUE_PROMPT = """你现在要审核为你生成的角色立绘图片。请以第一人称的角色视角来评价这张图片。
+    IMAGE_CRITIQUE_PROMPT: str = """你现在要审核为你生成的角色立绘图片。请以第一人称的角色视角来评价这张图片。
 
 【故事背景】
 {story_background}
@@ -537,7 +583,7 @@ class ActorConfig:
 
 请直接开始审核，用你的性格和语气说话。"""
 
-    EXPRESSION_DESCRIPTION_PROMPT = """你扮演 {name}。
+    EXPRESSION_DESCRIPTION_PROMPT: str = """你扮演 {name}。
 你的任务是描述你在呈现【{expression}】表情时的具体样貌。
 请提供详细的视觉描述，包含五官细节、面部神态、眼神、嘴型以及可能的肢体动作。
 描述将用于生成立绘图片。
@@ -547,48 +593,51 @@ class ActorConfig:
 
 请直接输出描述文本，不要包含其他内容。"""
 
+ActorConfig = _ActorConfig()
+
 # ==================== 文件路径配置 ====================
-class PathConfig:
+@dataclass(frozen=True, slots=True)
+class _PathConfig:
     """文件路径配置"""
     
     # 项目根目录
-    import sys
-    if getattr(sys, 'frozen', False):
-        PROJECT_ROOT = sys._MEIPASS
-    else:
-        PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    PROJECT_ROOT: str = (
+        sys._MEIPASS if getattr(sys, 'frozen', False)
+        else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
     
     # 数据目录
-    DATA_DIR = os.path.join(PROJECT_ROOT, "data")
-    IMAGES_DIR = os.path.join(DATA_DIR, "images")
-    CHARACTERS_DIR = os.path.join(IMAGES_DIR, "characters")
-    BACKGROUNDS_DIR = os.path.join(IMAGES_DIR, "backgrounds")  # 背景图目录
+    DATA_DIR: str = os.path.join(PROJECT_ROOT, "data")
+    IMAGES_DIR: str = os.path.join(DATA_DIR, "images")
+    CHARACTERS_DIR: str = os.path.join(IMAGES_DIR, "characters")
+    BACKGROUNDS_DIR: str = os.path.join(IMAGES_DIR, "backgrounds")  # 背景图目录
     
     # 游戏数据文件
-    GAME_DESIGN_FILE = os.path.join(DATA_DIR, "game_design.json")
-    STORY_FILE = os.path.join(DATA_DIR, "story.txt")
-    CHARACTER_INFO_FILE = os.path.join(DATA_DIR, "character_info.json")
+    GAME_DESIGN_FILE: str = os.path.join(DATA_DIR, "game_design.json")
+    STORY_FILE: str = os.path.join(DATA_DIR, "story.txt")
+    CHARACTER_INFO_FILE: str = os.path.join(DATA_DIR, "character_info.json")
     
     # 日志目录
-    LOG_DIR = os.path.join(PROJECT_ROOT, "logs")
-    TEXT_LOG_DIR = os.path.join(LOG_DIR, "text_log")   # 存放 performance_node.jsonl
-    IMAGE_LOG_DIR = os.path.join(LOG_DIR, "image_log") # 存放审核不合格图片
+    LOG_DIR: str = os.path.join(PROJECT_ROOT, "logs")
+    TEXT_LOG_DIR: str = os.path.join(LOG_DIR, "text_log")   # 存放 performance_node.jsonl
+    IMAGE_LOG_DIR: str = os.path.join(LOG_DIR, "image_log") # 存放审核不合格图片
     
-    @classmethod
-    def ensure_directories(cls):
-        """确保所有必要的目录存在"""
+    @functools.lru_cache(maxsize=1)
+    def ensure_directories(self):
+        """确保所有必要的目录存在（进程内只执行一次，首次使用时调用）"""
         dirs = [
-            cls.DATA_DIR,
-            cls.IMAGES_DIR,
-            cls.CHARACTERS_DIR,
-            cls.BACKGROUNDS_DIR,  # 添加背景目录
-            cls.LOG_DIR,
-            cls.TEXT_LOG_DIR,
-            cls.IMAGE_LOG_DIR
+            self.DATA_DIR,
+            self.IMAGES_DIR,
+            self.CHARACTERS_DIR,
+            self.BACKGROUNDS_DIR,  # 添加背景目录
+            self.LOG_DIR,
+            self.TEXT_LOG_DIR,
+            self.IMAGE_LOG_DIR
         ]
         for d in dirs:
-            os.makedirs(d, exist_ok=True)
+            # isdir 只需一次 stat，已存在时跳过 makedirs
+            if not os.path.isdir(d):
+                os.makedirs(d, exist_ok=True)
 
+PathConfig = _PathConfig()
 
-# 初始化时创建必要目录
-PathConfig.ensure_directories()
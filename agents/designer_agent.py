@@ -4,16 +4,30 @@ Designer Agent
 策划 Agent - 负责草拟游戏整体设计文档
 """
 
+import contextlib
+import functools
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from .llm_client import LLMClient
-import json
 
 from .config import DesignerConfig, PathConfig
-from .utils import JSONParser, FileHelper
+from .utils import JSONParser, FileHelper, PromptBuilder
 
 logger = logging.getLogger(__name__)
 
+# 设计文档必需字段
+_REQUIRED_DESIGN_FIELDS = frozenset(("title", "background", "story_graph", "characters", "scenes"))
+
+
+@functools.lru_cache(maxsize=8)
+def _format_design_prompt(template: str, character_count: int, total_nodes: int, requirements: str) -> str:
+    """格式化设计 prompt 的固定部分（审核-修改循环中参数不变，只需格式化一次）"""
+    return template.format(
+        character_count=character_count,
+        total_nodes=total_nodes,
+        requirements=requirements if requirements else "无"
+    )
+
 
 class DesignerAgent:
     """策划 Agent - 游戏设计文档草拟者"""
@@ -22,6 +36,7 @@ class DesignerAgent:
         """
         初始化策划 Agent
         """
+        PathConfig.ensure_directories()
         self.llm_client = LLMClient(api_key=api_key, base_url=base_url)
         self.config = DesignerConfig
         
@@ -49,32 +64,30 @@ class DesignerAgent:
         
         try:
             # 构建基础 prompt
-            user_prompt = self.config.GAME_DESIGN_PROMPT.format(
-                character_count=character_count,
-                total_nodes=self.config.TOTAL_NODES,
-                requirements=requirements if requirements else "无"
+            user_prompt = _format_design_prompt(
+                self.config.GAME_DESIGN_PROMPT,
+                character_count,
+                self.config.TOTAL_NODES,
+                requirements
             )
             
             # 如果有反馈和之前的设计，直接追加
             if feedback and previous_game_design:
                 logger.info("🔧 优化模式：根据反馈修改...")
-                user_prompt += f"\n\n【原游戏设计】\n{json.dumps(previous_game_design, ensure_ascii=False, indent=2)}\n\n【制作人反馈】\n{feedback}\n\n请修改游戏设计文档，解决制作人提出的问题。保持 JSON 格式不变，只修改内容。"
+                user_prompt += f"\n\n【原游戏设计】\n{PromptBuilder.game_design_json(previous_game_design)}\n\n【制作人反馈】\n{feedback}\n\n请修改游戏设计文档，解决制作人提出的问题。保持 JSON 格式不变，只修改内容。"
             
-            content = self.llm_client.chat_completion(
+            content = self._receive_json_response(
                 messages=[
                     {"role": "system", "content": self.config.SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
-                ],
-                temperature=self.config.TEMPERATURE,
-                json_mode=True
+                ]
             )
             
             game_design = JSONParser.parse_ai_response(content)
             
             # 验证必要字段
-            required_fields = ["title", "background", "story_graph", "characters", "scenes"]
-            if not JSONParser.validate_required_fields(game_design, required_fields):
-                raise ValueError("生成的设计文档缺少必需字段")
+            if missing := _REQUIRED_DESIGN_FIELDS - game_design.keys():
+                raise ValueError(f"生成的设计文档缺少必需字段: {', '.join(sorted(missing))}")
             
             logger.info(f"✅ 游戏设计完成: 《{game_design['title']}》")
             return game_design
@@ -82,3 +95,60 @@ class DesignerAgent:
         except Exception as e:
             logger.error(f"❌ 游戏设计生成失败: {e}")
             raise
+
+    def _receive_json_response(self, messages: List[Dict[str, Any]]) -> str:
+        """
+        以流式方式接收 JSON 响应，最外层对象闭合后立即停止读取
+        
+        流式调用失败时回退到带重试的普通调用
+        
+        Args:
+            messages: 消息列表
+            
+        Returns:
+            模型返回的原始文本
+        """
+        chunks = []
+        depth = 0
+        started = False
+        in_string = False
+        escape = False
+        
+        try:
+            # closing: 读到闭合括号 break 时立即关闭流，不等垃圾回收
+            with contextlib.closing(self.llm_client.chat_completion_stream(
+                messages=messages,
+                temperature=self.config.TEMPERATURE,
+                json_mode=True
+            )) as deltas:
+                for delta in deltas:
+                    chunks.append(delta)
+                    
+                    # 跟踪括号深度（忽略字符串内部的括号）
+                    for char in delta:
+                        if escape:
+                            escape = False
+                        elif char == '\\':
+                            escape = in_string
+                        elif char == '"':
+                            in_string = not in_string
+                        elif not in_string:
+                            if char == '{':
+                                depth += 1
+                                started = True
+                            elif char == '}':
+                                depth -= 1
+                    
+                    if started and depth == 0:
+                        logger.debug("最外层 JSON 对象已闭合，停止接收")
+                        break
+            
+            return "".join(chunks)
+            
+        except Exception as e:
+            logger.warning(f"⚠️ 流式接收失败，回退到普通调用: {e}")
+            return self.llm_client.chat_completion(
+                messages=messages,
+                temperature=self.config.TEMPERATURE,
+                json_mode=True
+            )
@@ -4,22 +4,96 @@ LLM Client
 统一的 LLM 客户端，支持 OpenAI 和 Google Gemini
 """
 
+import base64
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import mimetypes
 import os
-from typing import List, Dict, Any, Optional, Union
+import random
+import threading
+import time
+import zlib
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
 from .config import APIConfig
 
 logger = logging.getLogger(__name__)
 
+# 常见图片格式的文件头
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def _sniff_image_mime(data: bytes, path: str) -> str:
+    """根据文件头判断图片 MIME 类型，无法识别时按扩展名猜测"""
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    
+    mime_type, _ = mimetypes.guess_type(path)
+    return mime_type or "image/png"
+
+
+@functools.lru_cache(maxsize=16)
+def _path_to_data_url(path: str, mtime_ns: int, size: int) -> str:
+    """
+    将本地图片编码为 data URL
+    
+    以 (路径, 修改时间, 大小) 为缓存键：同一轮审核中反复发送的参考图只编码一次，
+    文件被重新生成后自动失效。立绘单张可达数 MB，因此缓存容量较小。
+    """
+    with open(path, "rb") as image_file:
+        image_data = image_file.read()
+    encoded_string = base64.b64encode(image_data).decode('utf-8')
+    return f"data:{_sniff_image_mime(image_data, path)};base64,{encoded_string}"
+
+
+def _load_image_part(path: str):
+    """读取本地图片并构造 Gemini 的图片 Part"""
+    from google.genai import types
+    
+    with open(path, "rb") as f:
+        image_data = f.read()
+    return types.Part.from_bytes(data=image_data, mime_type=_sniff_image_mime(image_data, path))
+
+
 class LLMClient:
     """统一的 LLM 客户端封装"""
     
+    # SDK 客户端按 (提供商, API Key, Base URL) 共享：各 Agent 复用同一个连接池，
+    # 避免每个实例各自建立 TLS 连接（SDK 客户端本身是线程安全的）
+    _shared_clients: Dict[Tuple[str, Optional[str], Optional[str]], Any] = {}
+    _shared_clients_lock = threading.Lock()
+    
+    # 进程内所有请求共享的并发名额：重试等待期间不占用名额
+    _request_slots = threading.BoundedSemaphore(max(1, APIConfig.MAX_CONCURRENT_LLM_REQUESTS))
+    
+    @classmethod
+    def _get_shared_client(cls, key: Tuple[str, Optional[str], Optional[str]], factory):
+        """获取共享的 SDK 客户端，不存在时用 factory 创建"""
+        with cls._shared_clients_lock:
+            client = cls._shared_clients.get(key)
+            if client is None:
+                client = cls._shared_clients[key] = factory()
+            return client
+    
     def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
         self.provider = APIConfig.TEXT_PROVIDER.lower()
         self.api_key = api_key
         self.base_url = base_url
         
+        # 响应缓存目录（可选，未配置时不缓存）
+        self.cache_dir = APIConfig.LLM_CACHE_DIR
+        
         self.client = None
+        self._google_config_cache: Dict[Tuple[float, Optional[str], bool], Any] = {}
         self._initialize_client()
         
     def _initialize_client(self):
@@ -32,7 +106,10 @@ class LLMClient:
             if not self.api_key:
                 logger.warning("⚠️ OpenAI API Key 未配置")
             else:
-                self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+                self.client = self._get_shared_client(
+                    ("openai", self.api_key, self.base_url),
+                    lambda: OpenAI(api_key=self.api_key, base_url=self.base_url)
+                )
                 
         elif self.provider == "google":
             try:
@@ -53,7 +130,10 @@ class LLMClient:
                         client_kwargs["http_options"] = {"base_url": self.base_url}
                         logger.info(f"✅ Google Client 初始化 (Endpoint: {self.base_url})")
                     
-                    self.client = genai.Client(**client_kwargs)
+                    self.client = self._get_shared_client(
+                        ("google", self.api_key, self.base_url),
+                        lambda: genai.Client(**client_kwargs)
+                    )
                     
             except ImportError:
                 logger.error("❌ google-genai 未安装，请运行: pip install google-genai")
@@ -80,34 +160,137 @@ class LLMClient:
         Returns:
             生成的文本内容
         """
-        import time
+        cache_key = None
+        if self.cache_dir:
+            cache_key = self._cache_key(messages, temperature, json_mode)
+            cached = self._cache_load(cache_key)
+            if cached is not None:
+                logger.debug(f"♻️ 命中 LLM 响应缓存: {cache_key[:12]}")
+                return cached
         
         for attempt in range(max_retries):
             try:
-                if self.provider == "openai":
-                    return self._chat_openai(messages, temperature, json_mode)
-                elif self.provider == "google":
-                    return self._chat_google(messages, temperature, json_mode)
-                else:
-                    raise ValueError(f"不支持的 LLM 提供商: {self.provider}")
+                with self._request_slots:
+                    if self.provider == "openai":
+                        result = self._chat_openai(messages, temperature, json_mode)
+                    elif self.provider == "google":
+                        result = self._chat_google(messages, temperature, json_mode)
+                    else:
+                        raise ValueError(f"不支持的 LLM 提供商: {self.provider}")
+                
+                if cache_key and result is not None:
+                    self._cache_store(cache_key, result)
+                return result
             except Exception as e:
                 if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # 指数退避: 1s, 2s, 4s
+                    wait_time = self._retry_delay(attempt, e)
                     logger.warning(f"⚠️ LLM 调用失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                    logger.info(f"   ⏳ 等待 {wait_time} 秒后重试...")
+                    logger.info(f"   ⏳ 等待 {wait_time:.1f} 秒后重试...")
                     time.sleep(wait_time)
                 else:
                     logger.error(f"❌ LLM 调用失败，已重试 {max_retries} 次: {e}")
                     raise
 
-    def _chat_openai(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> str:
-        if not self.client:
-            raise ValueError("OpenAI 客户端未初始化")
-            
-        # 处理消息中的本地图片路径，转换为 Base64
-        import base64
-        import mimetypes
+    @staticmethod
+    def _retry_delay(attempt: int, error: Exception) -> float:
+        """
+        计算重试等待时间
+        
+        限流 (429) / 服务不可用 (503) 且服务端给出 Retry-After 时以其为准；
+        否则使用带抖动的指数退避 (1s, 2s, 4s ... 上限 30s)，避免多个请求同时重试。
+        """
+        status = getattr(error, "status_code", None) or getattr(error, "code", None)
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if status in (429, 503) and headers is not None:
+            retry_after = headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), 60.0)
+                except ValueError:
+                    pass  # HTTP 日期格式，回退到指数退避
+        
+        return min(2 ** attempt, 30) + random.uniform(0, 0.5)
+
+    def _cache_key(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> str:
+        """
+        计算响应缓存键
         
+        对完整请求（各消息、提供商、模型、温度、JSON 模式）做一次 blake2b 哈希。
+        本地图片以 (路径, 修改时间, 大小) 参与哈希，图片重新生成后缓存自动失效。
+        """
+        hasher = hashlib.blake2b(digest_size=20)
+        for msg in messages:
+            content = msg["content"]
+            if isinstance(content, list):
+                items = []
+                for item in content:
+                    if item.get("type") == "image_url" and os.path.exists(item["image_url"]["url"]):
+                        stat = os.stat(item["image_url"]["url"])
+                        item = {**item, "stat": [stat.st_mtime_ns, stat.st_size]}
+                    items.append(item)
+                content = json.dumps(items, ensure_ascii=False, sort_keys=True)
+            hasher.update(f"{msg['role']}\n{content}\0".encode("utf-8"))
+        
+        hasher.update("|".join([self.provider, APIConfig.MODEL, str(round(temperature, 3)), str(json_mode)]).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _cache_load(self, cache_key: str) -> Optional[str]:
+        """读取缓存的响应，未命中返回 None"""
+        path = os.path.join(self.cache_dir, "responses", f"{cache_key}.z")
+        try:
+            with open(path, "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ 读取 LLM 缓存失败: {e}")
+            return None
+
+    def _cache_store(self, cache_key: str, response: str) -> None:
+        """压缩保存响应，先写临时文件再替换"""
+        try:
+            response_dir = os.path.join(self.cache_dir, "responses")
+            os.makedirs(response_dir, exist_ok=True)
+            
+            path = os.path.join(response_dir, f"{cache_key}.z")
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(response.encode("utf-8")))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"⚠️ 写入 LLM 缓存失败: {e}")
+
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        json_mode: bool = False
+    ) -> Iterator[str]:
+        """
+        流式聊天补全接口，逐段返回生成的文本
+
+        不经过 LLM_CACHE_DIR 响应缓存：调用方常在读到所需内容后提前关闭流，拿不到完整响应
+
+        Args:
+            messages: 消息列表 [{"role": "user", "content": "..."}, ...]
+            temperature: 温度参数
+            json_mode: 是否强制返回 JSON
+
+        Yields:
+            文本增量片段
+        """
+        # 并发名额只在建立请求期间占用（见 _stream_openai / _stream_google），
+        # 读取增量时释放，流式调用方读得慢也不会挡住其他 chat_completion
+        if self.provider == "openai":
+            yield from self._stream_openai(messages, temperature, json_mode)
+        elif self.provider == "google":
+            yield from self._stream_google(messages, temperature, json_mode)
+        else:
+            raise ValueError(f"不支持的 LLM 提供商: {self.provider}")
+
+    def _build_openai_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """处理消息中的本地图片路径，转换为 Base64"""
         processed_messages = []
         for msg in messages:
             new_msg = msg.copy()
@@ -117,18 +300,14 @@ class LLMClient:
                     if item.get("type") == "image_url":
                         url = item["image_url"]["url"]
                         if os.path.exists(url):
-                            # 本地文件，转换为 Base64
-                            mime_type, _ = mimetypes.guess_type(url)
-                            if not mime_type: mime_type = "image/png"
-                            
+                            # 本地文件，转换为 Base64（同一文件未修改时复用编码结果）
                             try:
-                                with open(url, "rb") as image_file:
-                                    encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                                    new_item = item.copy()
-                                    new_item["image_url"] = {
-                                        "url": f"data:{mime_type};base64,{encoded_string}"
-                                    }
-                                    new_content.append(new_item)
+                                stat = os.stat(url)
+                                new_item = item.copy()
+                                new_item["image_url"] = {
+                                    "url": _path_to_data_url(url, stat.st_mtime_ns, stat.st_size)
+                                }
+                                new_content.append(new_item)
                             except Exception as e:
                                 logger.error(f"❌ 读取图片失败: {e}")
                                 new_content.append(item) # 保持原样，虽然可能会失败
@@ -138,7 +317,13 @@ class LLMClient:
                         new_content.append(item)
                 new_msg["content"] = new_content
             processed_messages.append(new_msg)
+        return processed_messages
+
+    def _chat_openai(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> str:
+        if not self.client:
+            raise ValueError("OpenAI 客户端未初始化")
             
+        processed_messages = self._build_openai_messages(messages)
         response_format = {"type": "json_object"} if json_mode else None
         
         try:
@@ -153,57 +338,113 @@ class LLMClient:
             logger.error(f"OpenAI API 调用失败: {e}")
             raise
 
-    def _chat_google(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> str:
+    def _stream_openai(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> Iterator[str]:
         if not self.client:
-            raise ValueError("Google 客户端未初始化")
+            raise ValueError("OpenAI 客户端未初始化")
             
+        processed_messages = self._build_openai_messages(messages)
+        response_format = {"type": "json_object"} if json_mode else None
+        
+        try:
+            with self._request_slots:
+                stream = self.client.chat.completions.create(
+                    model=APIConfig.MODEL,
+                    messages=processed_messages,
+                    temperature=temperature,
+                    response_format=response_format,
+                    stream=True
+                )
+            # 调用方提前停止读取时也立即关闭响应，归还连接池中的连接
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                stream.close()
+        except Exception as e:
+            logger.error(f"OpenAI API 流式调用失败: {e}")
+            raise
+
+    def _build_google_request(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> Tuple[list, Any]:
+        """
+        将消息列表转换为 Gemini 的 contents 和生成配置
+        
+        连续的同角色消息合并为一个 Content，相邻的文本合并为一个 Part
+        """
         from google.genai import types
             
         # 提取系统提示词
-        system_instruction = None
+        system_texts = []
         contents = []
         
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            
+        for role, group in itertools.groupby(messages, key=lambda msg: msg["role"]):
             if role == "system":
-                system_instruction = content
-            elif role == "user":
-                parts = []
+                system_texts.extend(msg["content"] for msg in group)
+                continue
+            if role not in ("user", "assistant"):
+                continue
+            
+            parts = []
+            pending_texts = []
+            for msg in group:
+                content = msg["content"]
                 if isinstance(content, str):
-                    parts.append(types.Part.from_text(text=content))
-                elif isinstance(content, list):
-                    for item in content:
-                        if item.get("type") == "text":
-                            parts.append(types.Part.from_text(text=item["text"]))
-                        elif item.get("type") == "image_url":
-                            # 处理图片
-                            image_path = item["image_url"]["url"]
-                            try:
-                                # 如果是本地路径
-                                if os.path.exists(image_path):
-                                    with open(image_path, "rb") as f:
-                                        image_data = f.read()
-                                    parts.append(types.Part.from_bytes(data=image_data, mime_type="image/png")) # 假设是 PNG
-                                else:
-                                    # 暂时不支持网络 URL，或者需要下载
-                                    logger.warning(f"⚠️ Google Client 暂不支持网络图片 URL: {image_path}")
-                            except Exception as e:
-                                logger.error(f"❌ 读取图片失败: {e}")
-                
-                contents.append(types.Content(role="user", parts=parts))
-            elif role == "assistant":
-                contents.append(types.Content(role="model", parts=[types.Part.from_text(text=content)]))
+                    pending_texts.append(content)
+                    continue
+                if not isinstance(content, list):
+                    continue
+                for item in content:
+                    if item.get("type") == "text":
+                        pending_texts.append(item["text"])
+                    elif item.get("type") == "image_url":
+                        # 处理图片
+                        image_path = item["image_url"]["url"]
+                        try:
+                            # 如果是本地路径
+                            if os.path.exists(image_path):
+                                image_part = _load_image_part(image_path)
+                                if pending_texts:
+                                    parts.append(types.Part.from_text(text="\n\n".join(pending_texts)))
+                                    pending_texts = []
+                                parts.append(image_part)
+                            else:
+                                # 暂时不支持网络 URL，或者需要下载
+                                logger.warning(f"⚠️ Google Client 暂不支持网络图片 URL: {image_path}")
+                        except Exception as e:
+                            logger.error(f"❌ 读取图片失败: {e}")
+            
+            if pending_texts:
+                parts.append(types.Part.from_text(text="\n\n".join(pending_texts)))
+            contents.append(types.Content(role="user" if role == "user" else "model", parts=parts))
         
-        # 配置生成参数
-        config = types.GenerateContentConfig(
-            temperature=temperature,
-            system_instruction=system_instruction
-        )
+        system_instruction = "\n\n".join(system_texts) if system_texts else None
+        return contents, self._get_google_config(temperature, system_instruction, json_mode)
+
+    def _get_google_config(self, temperature: float, system_instruction: Optional[str], json_mode: bool) -> Any:
+        """
+        获取生成配置，相同 (温度, 系统提示词, JSON 模式) 复用同一对象
         
-        if json_mode:
-            config.response_mime_type = "application/json"
+        系统提示词按内容而非 id() 作为键：演员的系统提示词每次调用都会重新格式化
+        """
+        key = (round(temperature, 3), system_instruction, json_mode)
+        config = self._google_config_cache.get(key)
+        if config is None:
+            from google.genai import types
+            
+            # 配置生成参数
+            config = types.GenerateContentConfig(
+                temperature=temperature,
+                system_instruction=system_instruction,
+                response_mime_type="application/json" if json_mode else None
+            )
+            self._google_config_cache[key] = config
+        return config
+
+    def _chat_google(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> str:
+        if not self.client:
+            raise ValueError("Google 客户端未初始化")
+            
+        contents, config = self._build_google_request(messages, temperature, json_mode)
             
         try:
             response = self.client.models.generate_content(
@@ -216,3 +457,28 @@ class LLMClient:
         except Exception as e:
             logger.error(f"Google Gemini API 调用失败: {e}")
             raise
+
+    def _stream_google(self, messages: List[Dict[str, Any]], temperature: float, json_mode: bool) -> Iterator[str]:
+        if not self.client:
+            raise ValueError("Google 客户端未初始化")
+            
+        contents, config = self._build_google_request(messages, temperature, json_mode)
+            
+        try:
+            stream = self.client.models.generate_content_stream(
+                model=APIConfig.MODEL,
+                contents=contents,
+                config=config
+            )
+            # 请求在取第一个分片时才真正发出，名额占用到首个分片返回为止
+            with self._request_slots:
+                first_chunk = next(stream, None)
+            if first_chunk is None:
+                return
+            for chunk in itertools.chain((first_chunk,), stream):
+                if chunk.text:
+                    yield chunk.text
+            
+        except Exception as e:
+            logger.error(f"Google Gemini API 流式调用失败: {e}")
+            raise
@@ -7,7 +7,6 @@ Producer Agent
 import logging
 from typing import Dict, Any, Optional
 from .llm_client import LLMClient
-import json
 
 from .config import APIConfig, ProducerConfig, PathConfig, STANDARD_EXPRESSIONS
 from .utils import JSONParser, FileHelper, PromptBuilder
@@ -50,7 +49,7 @@ class ProducerAgent:
         
         try:
             prompt = self.config.GAME_DESIGN_CRITIQUE_PROMPT.format(
-                game_design=json.dumps(game_design, ensure_ascii=False, indent=2),
+                game_design=PromptBuilder.game_design_json(game_design),
                 user_requirements=user_requirements if user_requirements else "无特别要求",
                 expected_nodes=expected_nodes,
                 expected_characters=expected_characters
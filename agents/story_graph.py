@@ -4,6 +4,8 @@ Story Graph Utilities
 支持从树状结构迁移到 DAG 的工具函数
 """
 
+from array import array
+from collections import Counter, defaultdict, deque
 from typing import Dict, List, Set, Tuple, Any
 import logging
 
@@ -22,8 +24,10 @@ class StoryGraph:
         """
         self.nodes = {}
         self.edges = []
-        self.adjacency = {}  # {node_id: [(target_id, choice_text), ...]}
-        self.reverse_adjacency = {}  # {node_id: [parent_id, ...]}
+        self.adjacency = defaultdict(list)  # {node_id: [(target_id, choice_text), ...]}
+        self.reverse_adjacency = defaultdict(list)  # {node_id: [parent_id, ...]}
+        self.in_degree = Counter()  # {node_id: 父节点数}
+        self._endings_cache = None  # {node_id: (可达结局, ...)}，首次查询时构建
         
         if 'story_graph' not in data:
             raise ValueError("游戏设计数据中缺少 story_graph 字段")
@@ -35,17 +39,28 @@ class StoryGraph:
         self.nodes = story_graph.get('nodes', {})
         self.edges = story_graph.get('edges', [])
         
-        # 构建邻接表
-        self.adjacency = {node_id: [] for node_id in self.nodes}
-        self.reverse_adjacency = {node_id: [] for node_id in self.nodes}
+        # 单次遍历边，同时构建邻接表、反向邻接表和入度
+        # （无边的节点不会出现在邻接表中，查询统一走 get_children / get_parents）
+        self.adjacency = defaultdict(list)
+        self.reverse_adjacency = defaultdict(list)
+        self.in_degree = Counter()
         
         for edge in self.edges:
             from_node = edge['from']
             to_node = edge['to']
-            choice_text = edge.get('choice_text')
             
-            self.adjacency[from_node].append((to_node, choice_text))
+            self.adjacency[from_node].append((to_node, edge.get('choice_text')))
             self.reverse_adjacency[to_node].append(from_node)
+            self.in_degree[to_node] += 1
+        
+        # 节点整数下标 + 数组入度，拓扑排序时用下标访问代替字典查找
+        self._node_ids = list(self.nodes)
+        index = {node_id: i for i, node_id in enumerate(self._node_ids)}
+        self._child_indices = [
+            [index[child_id] for child_id, _ in self.adjacency.get(node_id, ()) if child_id in index]
+            for node_id in self._node_ids
+        ]
+        self._in_degree_array = array('i', (self.in_degree[node_id] for node_id in self._node_ids))
         
         logger.info(f"✅ 加载故事图：{len(self.nodes)} 个节点，{len(self.edges)} 条边")
     
@@ -77,24 +92,26 @@ class StoryGraph:
         Returns:
             节点ID列表，按依赖顺序排列
         """
-        in_degree = {node_id: len(self.get_parents(node_id)) for node_id in self.nodes}
-        queue = [node_id for node_id, degree in in_degree.items() if degree == 0]
-        result = []
+        in_degree = array('i', self._in_degree_array)
+        children = self._child_indices
+        queue = deque(i for i, degree in enumerate(in_degree) if degree == 0)
+        order = []
         
         while queue:
-            node_id = queue.pop(0)
-            result.append(node_id)
+            i = queue.popleft()
+            order.append(i)
             
-            for child_id, _ in self.get_children(node_id):
-                in_degree[child_id] -= 1
-                if in_degree[child_id] == 0:
-                    queue.append(child_id)
+            for child in children[i]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
         
-        if len(result) != len(self.nodes):
+        if len(order) != len(self._node_ids):
             logger.error("❌ 图中存在环路！拓扑排序失败")
             return []
         
-        return result
+        node_ids = self._node_ids
+        return [node_ids[i] for i in order]
     
     def validate(self) -> Tuple[bool, str]:
         """
@@ -138,12 +155,46 @@ class StoryGraph:
         Returns:
             结局节点ID列表
         """
+        if self._endings_cache is None:
+            self._endings_cache = self._build_endings_cache()
+        
+        cached = self._endings_cache.get(from_node)
+        if cached is not None:
+            return list(cached)
+        return self._collect_endings(from_node)
+    
+    def _build_endings_cache(self) -> Dict[str, Tuple[str, ...]]:
+        """
+        按逆拓扑序一次性计算所有节点的可达结局（DAG 上的动态规划）
+        
+        子节点的结局按顺序合并去重，结果顺序与 DFS 遍历一致
+        """
+        order = self.topological_sort()
+        if not order:
+            return {}  # 有环时无法预计算，查询回退到逐次 DFS
+        
+        cache = {}
+        for node_id in reversed(order):
+            children = self.get_children(node_id)
+            if not children:
+                cache[node_id] = (node_id,)
+            else:
+                merged = {}
+                for child_id, _ in children:
+                    merged.update(dict.fromkeys(cache.get(child_id, (child_id,))))
+                cache[node_id] = tuple(merged)
+        return cache
+    
+    def _collect_endings(self, from_node: str) -> List[str]:
+        """从指定节点做一次 DFS 收集结局"""
         visited = set()
         endings = []
+        stack = [from_node]  # 显式栈迭代 DFS，不受递归深度限制
         
-        def dfs(node_id: str):
+        while stack:
+            node_id = stack.pop()
             if node_id in visited:
-                return
+                continue
             visited.add(node_id)
             
             children = self.get_children(node_id)
@@ -151,8 +202,7 @@ class StoryGraph:
                 # 叶子节点即结局
                 endings.append(node_id)
             else:
-                for child_id, _ in children:
-                    dfs(child_id)
+                # 逆序入栈，保持与递归版本相同的访问顺序
+                stack.extend(child_id for child_id, _ in reversed(children))
         
-        dfs(from_node)
         return endings
@@ -4,17 +4,79 @@ Agent Utils
 所有 Agent 共用的工具函数
 """
 
+import atexit
 import json
 import logging
+import os
 import re
-from typing import Dict, Any, Optional
+import threading
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选加速依赖，未安装时使用标准库 json
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# 剧本中的立绘标记 <image id="角色名">表情</image>，模块加载时编译一次供各处复用
+IMAGE_TAG_RE = re.compile(r'<image\s+id="([^"]+)">([^<]+)</image>')
+
+# JSON 修复与文本清理使用的正则，同样只编译一次
+_FENCE_JSON_RE = re.compile(r'^```json\s*', re.MULTILINE)
+_FENCE_LINE_RE = re.compile(r'^```\s*$', re.MULTILINE)
+# 一次扫描同时处理注释与尾部逗号：字符串字面量原样跳过（避免误删 "http://..." 中的 //），
+# 尾部逗号与闭括号之间允许夹带空白和注释
+_JSON_CLEANUP_RE = re.compile(
+    r'("(?:[^"\\]|\\.)*")'                              # 1: 字符串字面量
+    r'|,(?:\s|//[^\n]*|/\*.*?\*/)*([\]}])'                 # 2: 尾部逗号后的闭括号
+    r'|//[^\n]*|/\*.*?\*/',                                # 注释
+    re.DOTALL
+)
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+_MULTI_NEWLINE_RE = re.compile(r'\n{3,}')
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+# 中文引号 -> 英文引号
+_CJK_QUOTE_TABLE = str.maketrans({'\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'"})
+# 括号匹配时只需关注的字符：转义符、引号和对应的括号，其余字符由正则引擎直接跳过
+_BRACKET_TOKEN_RES = {
+    '{': re.compile(r'[\\"{}]'),
+    '[': re.compile(r'[\\"\[\]]'),
+}
+
 
 class JSONParser:
     """JSON 解析工具类"""
     
+    @staticmethod
+    def loads(content: str) -> Any:
+        """
+        解析 JSON 文本，优先使用 orjson
+        
+        orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方无需区分
+        """
+        if orjson is not None:
+            return orjson.loads(content)
+        return json.loads(content)
+    
+    @staticmethod
+    def dumps(data: Any, indent: bool = True) -> str:
+        """
+        序列化为 JSON 文本（不转义中文），优先使用 orjson
+        
+        orjson 无法处理的数据（如超出 64 位的整数）回退到标准库 json
+        """
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+            try:
+                return orjson.dumps(data, option=option).decode('utf-8')
+            except TypeError:  # orjson.JSONEncodeError 是 TypeError 的子类
+                pass
+        if indent:
+            return json.dumps(data, ensure_ascii=False, indent=2)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    
     @staticmethod
     def parse_ai_response(content: str, save_on_fail: bool = True) -> Dict[str, Any]:
         """
@@ -32,15 +94,22 @@ class JSONParser:
         """
         try:
             # 第一次尝试：直接解析
-            return json.loads(content)
+            return JSONParser.loads(content)
         except json.JSONDecodeError as e:
+            if '{' not in content and '[' not in content:
+                # 完全不含 JSON 结构（如模型拒答或报错文本），修复流程无从下手
+                logger.error(f"❌ 响应中没有 JSON 内容: {e}")
+                if save_on_fail:
+                    JSONParser._save_failed_response(content, e)
+                raise
+            
             logger.warning(f"⚠️  直接 JSON 解析失败: {e}")
             logger.info("🔧 尝试修复 JSON 格式...")
             
             try:
                 # 尝试修复后再解析
                 fixed_content = JSONParser.fix_json_format(content)
-                result = json.loads(fixed_content)
+                result = JSONParser.loads(fixed_content)
                 logger.info("✅ JSON 修复成功")
                 return result
             except json.JSONDecodeError as e2:
@@ -64,9 +133,6 @@ class JSONParser:
             content: 失败的内容
             error: 错误信息
         """
-        import os
-        from datetime import datetime
-        
         try:
             log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
             os.makedirs(log_dir, exist_ok=True)
@@ -99,9 +165,9 @@ class JSONParser:
         original_content = content
         
         # 1. 移除 markdown 代码块标记
-        content = re.sub(r'^```json\s*', '', content, flags=re.MULTILINE)
-        content = re.sub(r'^```\s*$', '', content, flags=re.MULTILINE)
-        content = re.sub(r'```', '', content)
+        content = _FENCE_JSON_RE.sub('', content)
+        content = _FENCE_LINE_RE.sub('', content)
+        content = content.replace('```', '')
         
         # 2. 移除 BOM 标记和首尾空白
         content = content.strip('\ufeff').strip()
@@ -127,35 +193,8 @@ class JSONParser:
             return content
 
         if start != -1:
-            # 简单的括号计数法来找到匹配的结束括号
-            count = 0
-            end = -1
-            in_string = False
-            escape = False
-            
-            for i in range(start, len(content)):
-                char = content[i]
-                
-                if escape:
-                    escape = False
-                    continue
-                    
-                if char == '\\':
-                    escape = True
-                    continue
-                    
-                if char == '"':
-                    in_string = not in_string
-                    continue
-                
-                if not in_string:
-                    if char == open_char:
-                        count += 1
-                    elif char == close_char:
-                        count -= 1
-                        if count == 0:
-                            end = i
-                            break
+            # 括号计数法找到匹配的结束括号
+            end = JSONParser._find_closing_bracket(content, start, open_char)
             
             if end != -1:
                 content = content[start:end+1]
@@ -165,17 +204,9 @@ class JSONParser:
                 if end != -1 and start < end:
                     content = content[start:end+1]
         
-        # 4. 移除注释（JSON 不支持注释）
-        # 移除单行注释 //
-        content = re.sub(r'//.*$', '', content, flags=re.MULTILINE)
-        # 移除多行注释 /* */
-        content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
-        
-        # 5. 修复常见的尾部逗号问题
-        # 修复数组尾部逗号 [1, 2, 3,] -> [1, 2, 3]
-        content = re.sub(r',\s*]', ']', content)
-        # 修复对象尾部逗号 {"a": 1,} -> {"a": 1}
-        content = re.sub(r',\s*}', '}', content)
+        # 4. 移除注释（JSON 不支持注释）并修复尾部逗号，一次扫描完成
+        # [1, 2, 3,] -> [1, 2, 3]，{"a": 1,} -> {"a": 1}
+        content = _JSON_CLEANUP_RE.sub(JSONParser._cleanup_replacement, content)
         
         # 6. 修复字符串中的换行符问题
         # 将字符串中的真实换行符替换为 \n
@@ -189,9 +220,11 @@ class JSONParser:
         # 这个正则比较复杂，谨慎使用
         # content = re.sub(r'"([^"\\]*(?:\\.[^"\\]*)*)"', fix_string_newlines, content)
         
-        # 7. 替换中文引号为英文引号（如果有）
-        content = content.replace('"', '"').replace('"', '"')
-        content = content.replace(''', "'").replace(''', "'")
+        # 7. 替换中文引号为英文引号
+        # 仅当全文没有英文双引号时才替换（说明模型用中文引号充当了 JSON 引号）；
+        # 否则中文引号出现在字符串内容里，替换反而会破坏 JSON
+        if '"' not in content:
+            content = content.translate(_CJK_QUOTE_TABLE)
         
         logger.debug(f"修复前: {len(original_content)} 字符")
         logger.debug(f"修复后: {len(content)} 字符")
@@ -199,21 +232,60 @@ class JSONParser:
         return content
     
     @staticmethod
-    def validate_required_fields(data: Dict[str, Any], required_fields: list) -> bool:
+    def _cleanup_replacement(match: re.Match) -> str:
+        """_JSON_CLEANUP_RE 的替换函数：保留字符串和闭括号，删除注释与尾部逗号"""
+        return match.group(1) or match.group(2) or ''
+    
+    @staticmethod
+    def _find_closing_bracket(content: str, start: int, open_char: str) -> int:
+        """
+        从 start 处的开括号起，找到与之匹配的闭括号位置（忽略字符串内的括号）
+        
+        只逐个处理转义符、引号和括号，普通字符由正则跳过
+        
+        Returns:
+            闭括号下标，未找到返回 -1
+        """
+        depth = 0
+        in_string = False
+        escaped_pos = -1  # 被反斜杠转义的字符位置
+        
+        for match in _BRACKET_TOKEN_RES[open_char].finditer(content, start):
+            i = match.start()
+            if i == escaped_pos:
+                continue
+            
+            char = match.group()
+            if char == '\\':
+                escaped_pos = i + 1
+            elif char == '"':
+                in_string = not in_string
+            elif not in_string:
+                if char == open_char:
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return i
+        
+        return -1
+    
+    @staticmethod
+    def validate_required_fields(data: Dict[str, Any], required_fields: Iterable[str]) -> bool:
         """
         验证字典是否包含所有必需字段
         
         Args:
             data: 要验证的字典
-            required_fields: 必需字段列表
+            required_fields: 必需字段（列表、元组或集合均可）
             
         Returns:
             是否通过验证
         """
-        missing_fields = [field for field in required_fields if field not in data]
+        missing_fields = set(required_fields) - data.keys()
         
         if missing_fields:
-            logger.error(f"❌ 缺少必需字段: {', '.join(missing_fields)}")
+            logger.error(f"❌ 缺少必需字段: {', '.join(sorted(missing_fields))}")
             return False
         
         return True
@@ -222,6 +294,25 @@ class JSONParser:
 class PromptBuilder:
     """Prompt 构建工具类"""
     
+    # 最近一次序列化的 (对象, 文本)；持有对象引用，避免 id 被复用导致误命中
+    _last_game_design_json: Tuple[Any, str] = (None, "")
+    
+    @staticmethod
+    def game_design_json(game_design: Dict[str, Any]) -> str:
+        """
+        将游戏设计文档序列化为放入 Prompt 的紧凑 JSON 文本
+        
+        审核-修改循环中，同一份设计稿先交给制作人审核，再作为原稿交给策划修改，
+        按对象身份缓存最近一次结果，避免重复序列化。设计稿交出后不应原地修改。
+        """
+        cached_design, cached_json = PromptBuilder._last_game_design_json
+        if cached_design is game_design:
+            return cached_json
+        
+        design_json = JSONParser.dumps(game_design, indent=False)  # 紧凑格式，减少 token
+        PromptBuilder._last_game_design_json = (game_design, design_json)
+        return design_json
+    
     @staticmethod
     def format_with_fallback(template: str, **kwargs) -> str:
         """
@@ -235,7 +326,7 @@ class PromptBuilder:
             格式化后的字符串
         """
         # 提取模板中所有的占位符
-        placeholders = re.findall(r'\{(\w+)\}', template)
+        placeholders = _PLACEHOLDER_RE.findall(template)
         
         # 为缺失的参数填充默认值
         defaults = {
@@ -259,6 +350,36 @@ class PromptBuilder:
 class FileHelper:
     """文件操作助手"""
     
+    # 文本文件读取缓存 {路径: ((st_mtime_ns, st_size), 内容)}
+    _text_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+    
+    @staticmethod
+    def read_text_cached(file_path: str) -> Optional[str]:
+        """
+        读取文本文件，文件未变化（修改时间与大小相同）时直接返回上次读取的内容
+        
+        Args:
+            file_path: 文件路径
+            
+        Returns:
+            文件内容，文件不存在返回 None
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            FileHelper._text_cache.pop(file_path, None)
+            return None
+        
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = FileHelper._text_cache.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        FileHelper._text_cache[file_path] = (signature, content)
+        return content
+    
     @staticmethod
     def safe_write_json(file_path: str, data: Dict[str, Any]) -> bool:
         """
@@ -272,11 +393,10 @@ class FileHelper:
             是否成功
         """
         try:
-            import os
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
             with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.write(JSONParser.dumps(data))
             
             logger.info(f"💾 JSON 已保存: {file_path}")
             return True
@@ -298,7 +418,7 @@ class FileHelper:
         """
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                return JSONParser.loads(f.read())
         except FileNotFoundError:
             logger.warning(f"⚠️  文件不存在: {file_path}")
             return None
@@ -322,7 +442,6 @@ class FileHelper:
             是否成功
         """
         try:
-            import os
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             
             with open(file_path, 'a', encoding='utf-8') as f:
@@ -334,6 +453,62 @@ class FileHelper:
         except Exception as e:
             logger.error(f"❌ 追加文本失败: {e}")
             return False
+    
+    # 持续追加写入的文件句柄 {路径: 文件对象}
+    _append_handles: Dict[str, Any] = {}
+    # 节点并行生成时多个线程同时追加/关闭句柄，打开、写入、关闭都在锁内进行
+    _append_handles_lock = threading.Lock()
+    
+    @staticmethod
+    def append_text_stream(file_path: str, text: str) -> bool:
+        """
+        通过常驻的追加句柄写入文本（原样写入，不额外添加换行）
+        
+        适用于同一文件被频繁追加的场景（如逐轮记录的表演日志），
+        避免每次追加都重新打开、关闭文件。每次写入后立即 flush，其他读者可见。
+        
+        Args:
+            file_path: 文件路径
+            text: 要追加的文本
+            
+        Returns:
+            是否成功
+        """
+        try:
+            with FileHelper._append_handles_lock:
+                handle = FileHelper._append_handles.get(file_path)
+                if handle is None or handle.closed:
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    handle = open(file_path, 'ab', buffering=65536)
+                    FileHelper._append_handles[file_path] = handle
+                
+                handle.write(text.encode('utf-8'))
+                handle.flush()
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ 追加文本失败: {e}")
+            return False
+    
+    @staticmethod
+    def close_append_stream(file_path: str) -> None:
+        """关闭指定文件的追加句柄（删除或重写该文件前调用）"""
+        with FileHelper._append_handles_lock:
+            handle = FileHelper._append_handles.pop(file_path, None)
+            if handle is not None:
+                handle.close()
+    
+    @staticmethod
+    def close_all_append_streams() -> None:
+        """关闭所有追加句柄"""
+        with FileHelper._append_handles_lock:
+            handles = list(FileHelper._append_handles.values())
+            FileHelper._append_handles.clear()
+            for handle in handles:
+                handle.close()
+
+
+atexit.register(FileHelper.close_all_append_streams)
 
 
 class TextProcessor:
@@ -351,13 +526,32 @@ class TextProcessor:
             清理后的文本
         """
         # 移除多余的空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = _MULTI_NEWLINE_RE.sub('\n\n', text)
         
         # 移除首尾空白
         text = text.strip()
         
         return text
     
+    @staticmethod
+    def truncate_text(text: str, max_chars: int, suffix: str = "...") -> str:
+        """
+        按字符预算截断文本（中文文本中一个字符约等于一个 token）
+        
+        Args:
+            text: 原始文本
+            max_chars: 最大字符数（包含省略后缀）
+            suffix: 截断时追加的后缀
+            
+        Returns:
+            不超过 max_chars 的文本
+        """
+        if len(text) <= max_chars:
+            return text
+        if max_chars <= len(suffix):
+            return text[:max_chars]
+        return text[:max_chars - len(suffix)].rstrip() + suffix
+    
     @staticmethod
     def extract_json_from_text(text: str) -> Optional[str]:
         """
@@ -370,7 +564,7 @@ class TextProcessor:
             提取的 JSON 字符串，找不到返回 None
         """
         # 尝试找到 JSON 对象
-        match = re.search(r'\{.*\}', text, re.DOTALL)
+        match = _JSON_OBJECT_RE.search(text)
         if match:
             return match.group(0)
         
@@ -382,5 +576,6 @@ __all__ = [
     'JSONParser',
     'PromptBuilder',
     'FileHelper',
-    'TextProcessor'
+    'TextProcessor',
+    'IMAGE_TAG_RE'
 ]
@@ -5,17 +5,30 @@ Writer Agent
 使用 GPT-4 根据游戏设计和角色状态创作对话和事件
 """
 
+import contextlib
+import functools
+import hashlib
+import io
 import logging
+import queue
 import re
-import json
-from typing import Dict, Any, List, Optional
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 from .llm_client import LLMClient
 
 from .config import APIConfig, WriterConfig, PathConfig, ArtistConfig
-from .utils import JSONParser, FileHelper, TextProcessor
+from .utils import JSONParser, FileHelper, TextProcessor, IMAGE_TAG_RE
 
 logger = logging.getLogger(__name__)
 
+# 选项行与导演回复解析使用的正则，模块加载时编译一次
+_CHOICE_OPTION_RE = re.compile(r'选项(\d+):\s*"(.+?)"\s*→\s*\[(.+?)\]')
+_CHARACTER_TAG_RE = re.compile(r'<character>(.+?)</character>', re.DOTALL)
+_ADVICE_TAG_RE = re.compile(r'<advice>(.+?)</advice>', re.DOTALL)
+
+# 剧情片段必须包含的字段
+_PLOT_REQUIRED_FIELDS = ('summary',)
+
 
 class WriterAgent:
     """编剧 Agent - 剧情生成器"""
@@ -28,11 +41,52 @@ class WriterAgent:
             api_key: API Key
             base_url: API Base URL
         """
+        PathConfig.ensure_directories()
         self.llm_client = LLMClient(api_key=api_key, base_url=base_url)
         self.config = WriterConfig
+        # 角色信息文本缓存 {角色字典 id 元组: (角色字典元组, 文本)}
+        self._characters_info_cache: Dict[tuple, tuple] = {}
+        # 剧情摘要缓存 {剧情内容哈希: 摘要}，断点续写和多分支共享祖先时避免重复摘要
+        self._summary_cache: Dict[bytes, str] = {}
+        # 多个节点并行生成时共用同一个 WriterAgent，淘汰与写入需加锁
+        self._summary_cache_lock = threading.Lock()
         
         logger.info("✅ 编剧 Agent 初始化成功")
     
+    def _format_characters_info(self, characters: List[Dict[str, Any]]) -> str:
+        """
+        构建角色详细信息文本
+        
+        导演每一轮对话都会传入同一批角色字典，按对象身份缓存格式化结果
+        """
+        key = tuple(map(id, characters))
+        cached = self._characters_info_cache.get(key)
+        if cached is not None and all(a is b for a, b in zip(cached[0], characters)):
+            return cached[1]
+        
+        # 每个角色分得相同的字符预算，超出部分截断，控制每次请求的提示长度
+        per_char_budget = max(
+            self.config.CHARACTER_INFO_MAX_CHARS // max(len(characters), 1),
+            self.config.CHARACTER_INFO_MIN_CHARS
+        )
+        characters_info = "\n".join([
+            TextProcessor.truncate_text(
+                f"- {char.get('name', 'Unknown')}（{char.get('gender', '')},{char.get('personality', '')}）：{char.get('appearance', '')}。背景：{char.get('background', '')[:80]}...",
+                per_char_budget
+            )
+            for char in characters
+        ])
+        if len(self._characters_info_cache) >= 8:
+            self._characters_info_cache.clear()
+        self._characters_info_cache[key] = (tuple(characters), characters_info)
+        return characters_info
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _format_scenes(scenes: tuple, default: str) -> str:
+        """场景列表文本，每个节点都传入相同的场景名，按内容缓存"""
+        return ", ".join(scenes) if scenes else default
+    
     def split_node_into_plots(
         self,
         node_summary: str,
@@ -44,18 +98,114 @@ class WriterAgent:
         """将节点概要切分为剧情片段"""
         logger.info(f"✂️  正在切分剧情片段 (目标片段数: {segment_count})...")
         
+        messages = self._build_plot_split_messages(
+            node_summary, long_term_memory, available_scenes, available_characters, segment_count
+        )
+        try:
+            response = self.llm_client.chat_completion(messages=messages, temperature=0.7)
+            return self._validate_plots(JSONParser.parse_ai_response(response))
+        except Exception as e:
+            logger.error(f"❌ 切分剧情失败: {e}")
+            return []
+    
+    @staticmethod
+    def _is_valid_plot(plot: Any) -> bool:
+        """剧情片段需为字典且包含必需字段"""
+        return isinstance(plot, dict) and all(plot.get(field) for field in _PLOT_REQUIRED_FIELDS)
+    
+    @classmethod
+    def _validate_plots(cls, data: Any) -> List[Dict[str, Any]]:
+        """
+        校验切分结果的结构，尽早发现格式错误而不是在表演循环中出错
+        
+        兼容 {"plots": [...]} 这类外层包装，丢弃缺少必需字段的片段
+        """
+        if isinstance(data, dict):
+            data = next((value for value in data.values() if isinstance(value, list)), [data])
+        if not isinstance(data, list):
+            raise ValueError(f"剧情切分结果应为列表，实际为 {type(data).__name__}")
+        
+        plots = [plot for plot in data if cls._is_valid_plot(plot)]
+        if len(plots) < len(data):
+            logger.warning(f"⚠️ 丢弃了 {len(data) - len(plots)} 个格式不完整的剧情片段")
+        return plots
+    
+    def stream_node_plots(
+        self,
+        node_summary: str,
+        long_term_memory: str,
+        available_scenes: List[str] = [],
+        available_characters: List[Dict[str, Any]] = [],
+        segment_count: int = 3
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        流式切分剧情片段：每个片段对象一闭合就立即产出
+        
+        后台线程持续接收流式响应，调用方可以在第一个片段到达后就开始表演，
+        无需等待整个切分结果。流式调用失败且尚未产出任何片段时，
+        回退到 split_node_into_plots 的普通调用。
+        
+        Yields:
+            剧情片段字典，与 split_node_into_plots 返回的元素格式相同
+        """
+        logger.info(f"✂️  正在流式切分剧情片段 (目标片段数: {segment_count})...")
+        messages = self._build_plot_split_messages(
+            node_summary, long_term_memory, available_scenes, available_characters, segment_count
+        )
+        plots_queue = queue.Queue()
+        done = object()
+        # 调用方提前关闭生成器时置位，后台线程随之停止接收并关闭流
+        cancelled = threading.Event()
+        
+        def produce():
+            emitted = 0
+            plots = self._iter_streamed_plots(messages, cancelled)
+            try:
+                for plot in plots:
+                    if cancelled.is_set():
+                        break
+                    plots_queue.put(plot)
+                    emitted += 1
+            except Exception as e:
+                logger.warning(f"⚠️ 流式切分剧情失败 (已接收 {emitted} 个片段): {e}")
+            finally:
+                plots.close()
+            
+            try:
+                if not emitted and not cancelled.is_set():
+                    for plot in self.split_node_into_plots(
+                        node_summary, long_term_memory, available_scenes, available_characters, segment_count
+                    ):
+                        plots_queue.put(plot)
+            finally:
+                plots_queue.put(done)
+        
+        threading.Thread(target=produce, name="plot-split-stream", daemon=True).start()
+        
+        try:
+            while (plot := plots_queue.get()) is not done:
+                yield plot
+        finally:
+            cancelled.set()
+    
+    def _build_plot_split_messages(
+        self,
+        node_summary: str,
+        long_term_memory: str,
+        available_scenes: List[str],
+        available_characters: List[Dict[str, Any]],
+        segment_count: int
+    ) -> List[Dict[str, str]]:
+        """构建剧情切分请求的消息列表"""
         # 根据 segment_count 生成不同的指令
         if segment_count == 1:
             split_instruction = "保持为一个完整的场景，不要切分。"
         else:
             split_instruction = f"每个片段应该是一个小的场景或事件，具有明确的冲突或行动。"
         
-        scenes_str = ", ".join(available_scenes) if available_scenes else "未指定，请根据剧情自由选择"
+        scenes_str = self._format_scenes(tuple(available_scenes), "未指定，请根据剧情自由选择")
         # 构建角色的详细信息
-        characters_info = "\n".join([
-            f"- {char.get('name', 'Unknown')}（{char.get('gender', '')},{char.get('personality', '')}）：{char.get('appearance', '')}。背景：{char.get('background', '')[:80]}..."
-            for char in available_characters
-        ]) if available_characters else "未指定角色"
+        characters_info = self._format_characters_info(available_characters) if available_characters else "未指定角色"
 
         prompt = self.config.PLOT_SPLIT_PROMPT.format(
             segment_count=segment_count,
@@ -65,21 +215,71 @@ class WriterAgent:
             available_scenes=scenes_str,
             available_characters=characters_info
         )
-        try:
-            # 使用专门的 System Prompt 以确保 JSON 格式
-            system_prompt = "你是一个剧情结构分析助手。你的任务是将剧情概要切分为结构化的片段，并严格输出 JSON 格式。"
-            
-            response = self.llm_client.chat_completion(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7
-            )
-            return JSONParser.parse_ai_response(response)
-        except Exception as e:
-            logger.error(f"❌ 切分剧情失败: {e}")
-            return []
+        # 使用专门的 System Prompt 以确保 JSON 格式
+        system_prompt = "你是一个剧情结构分析助手。你的任务是将剧情概要切分为结构化的片段，并严格输出 JSON 格式。"
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _iter_streamed_plots(
+        self,
+        messages: List[Dict[str, str]],
+        cancelled: Optional[threading.Event] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        接收流式响应，增量扫描括号，第一层数组中的对象一闭合就解析产出
+        
+        兼容直接输出数组以及数组外再包一层对象（如 {"plots": [...]}）的情况；
+        cancelled 被置位后在下一个增量处停止接收
+        """
+        buffer = []
+        pos = 0
+        stack = []  # 未闭合的括号
+        array_depth = None  # 第一层数组所在的深度
+        object_start = None
+        in_string = False
+        escape = False
+        
+        # closing: 被取消或调用方关闭本生成器时立即关闭底层流
+        with contextlib.closing(self.llm_client.chat_completion_stream(messages=messages, temperature=0.7)) as deltas:
+            for delta in deltas:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                buffer.append(delta)
+                for char in delta:
+                    if escape:
+                        escape = False
+                    elif char == '\\':
+                        escape = in_string
+                    elif char == '"':
+                        in_string = not in_string
+                    elif in_string:
+                        pass
+                    elif char == '[' or char == '{':
+                        stack.append(char)
+                        if char == '[' and array_depth is None:
+                            array_depth = len(stack)
+                        elif char == '{' and array_depth is not None and len(stack) == array_depth + 1:
+                            object_start = pos
+                    elif char == ']' or char == '}':
+                        if stack:
+                            stack.pop()
+                        if char == '}' and object_start is not None and len(stack) == array_depth:
+                            text = "".join(buffer)
+                            object_text = text[object_start:pos + 1]
+                            buffer = [text]
+                            object_start = None
+                            try:
+                                plot = JSONParser.parse_ai_response(object_text, save_on_fail=False)
+                            except Exception as e:
+                                logger.warning(f"⚠️ 跳过无法解析的剧情片段: {e}")
+                                continue
+                            if self._is_valid_plot(plot):
+                                yield plot
+                            else:
+                                logger.warning("⚠️ 跳过格式不完整的剧情片段")
+                    pos += 1
 
     def synthesize_script(
         self,
@@ -92,15 +292,12 @@ class WriterAgent:
         """将演员表演整合成剧本"""
         logger.info("🧩 正在整合剧本 (基于结构化数据)...")
         
-        # 将结构化数据转换为 JSON 字符串供 LLM 阅读
-        performances_json = json.dumps(plot_performances, ensure_ascii=False, indent=2)
-        choices_json = json.dumps(choices, ensure_ascii=False, indent=2)
-        scenes_str = ", ".join(available_scenes) if available_scenes else "未指定"
+        # 将结构化数据转换为 JSON 字符串供 LLM 阅读（紧凑格式，减少 token）
+        performances_json = JSONParser.dumps(plot_performances, indent=False)
+        choices_json = JSONParser.dumps(choices, indent=False)
+        scenes_str = self._format_scenes(tuple(available_scenes), "未指定")
         # 构建角色的详细信息
-        characters_info = "\n".join([
-            f"- {char.get('name', 'Unknown')}（{char.get('gender', '')},{char.get('personality', '')}）：{char.get('appearance', '')}。背景：{char.get('background', '')[:80]}..."
-            for char in available_characters
-        ]) if available_characters else "未指定"
+        characters_info = self._format_characters_info(available_characters) if available_characters else "未指定"
         
         prompt = self.config.PLOT_SYNTHESIS_PROMPT.format(
             plot_performances=performances_json,
@@ -134,10 +331,7 @@ class WriterAgent:
             (角色名, 剧情指导) 或 ("STOP", "")
         """
         # 构建角色的详细信息
-        characters_info = "\n".join([
-            f"- {char.get('name', 'Unknown')}（{char.get('gender', '')},{char.get('personality', '')}）：{char.get('appearance', '')}。背景：{char.get('background', '')[:80]}..."
-            for char in characters
-        ])
+        characters_info = self._format_characters_info(characters)
         
         prompt = self.config.NEXT_SPEAKER_PROMPT.format(
             plot_summary=plot_summary,
@@ -155,10 +349,8 @@ class WriterAgent:
             response = response.strip()
             
             # 解析响应
-            import re
-            
             # 提取 <character> 标签
-            char_match = re.search(r'<character>(.+?)</character>', response, re.DOTALL)
+            char_match = _CHARACTER_TAG_RE.search(response)
             if not char_match:
                 logger.warning("⚠️ 导演返回格式错误，未找到 <character> 标签")
                 return "STOP", ""
@@ -170,7 +362,7 @@ class WriterAgent:
                 return "STOP", ""
             
             # 提取 <advice> 标签
-            advice_match = re.search(r'<advice>(.+?)</advice>', response, re.DOTALL)
+            advice_match = _ADVICE_TAG_RE.search(response)
             guidance = advice_match.group(1).strip() if advice_match else ""
             
             logger.debug(f"🎬 解析结果: 角色={speaker}, 指导={guidance}")
@@ -187,7 +379,7 @@ class WriterAgent:
         Args:
             story_text: 要追加的剧情文本
         """
-        if not FileHelper.safe_append_text(PathConfig.STORY_FILE, story_text):
+        if not FileHelper.append_text_stream(PathConfig.STORY_FILE, "\n" + story_text + "\n"):
             raise Exception("追加剧情失败")
     
     @staticmethod
@@ -199,15 +391,14 @@ class WriterAgent:
             剧情文本，文件不存在返回空字符串
         """
         try:
-            with open(PathConfig.STORY_FILE, 'r', encoding='utf-8') as f:
-                story = f.read()
+            story = FileHelper.read_text_cached(PathConfig.STORY_FILE)
+            if story is None:
+                logger.warning(f"⚠️  剧情文件不存在，将创建新文件")
+                return ""
             
             logger.info(f"📖 剧情文件已加载: {len(story)} 字符")
             return story
             
-        except FileNotFoundError:
-            logger.warning(f"⚠️  剧情文件不存在，将创建新文件")
-            return ""
         except Exception as e:
             logger.error(f"❌ 加载剧情文件失败: {e}")
             return ""
@@ -225,30 +416,32 @@ class WriterAgent:
             剧情片段列表，每个片段包含对话、图像、选项等信息
         """
         logger.info("📝 解析剧情文本...")
-        
+        # StringIO 逐行迭代，不再额外生成整份行列表
+        return self._parse_story_lines(io.StringIO(story_text))
+    
+    def _parse_story_lines(self, lines: Iterable[str]) -> List[Dict[str, Any]]:
+        """逐行解析剧情，lines 可以是文件对象等任意行迭代器"""
         segments = []
         current_location = None
         current_time = None
         
-        lines = story_text.strip().split('\n')
-        
         for line in lines:
+            # 去除首尾空白并跳过空行
             line = line.strip()
-            
             if not line:
                 continue
             
-            # 解析场景标题 (## 地点 或 ## 地点 - 时间)
-            scene_match = re.match(r'##\s*(.+)', line)
+            # 按行首字符分派，只对可能命中的规则做检查，避免逐条尝试正则
+            first_char = line[0]
             
-            if scene_match:
-                content = scene_match.group(1).strip()
-                if '-' in content:
-                    parts = content.split('-', 1)
-                    new_location = parts[0].strip()
-                    new_time = parts[1].strip()
+            # 解析场景标题 (## 地点 或 ## 地点 - 时间)
+            if first_char == '#' and len(line) > 2 and line.startswith('##'):
+                content = line[2:].strip()
+                new_location, sep, new_time = content.partition('-')
+                if sep:
+                    new_location = new_location.strip()
+                    new_time = new_time.strip()
                 else:
-                    new_location = content
                     new_time = "Day" # 默认时间
                 
                 # 如果场景变化，添加场景切换标记
@@ -264,25 +457,51 @@ class WriterAgent:
                 continue
             
             # 解析图像标注 <image id="角色">表情</image>
-            image_match = re.match(r'<image\s+id="([^"]+)">([^<]+)</image>', line)
-            if image_match:
-                character = image_match.group(1).strip()
-                expression = image_match.group(2).strip()
-                
-                segments.append({
-                    "type": "image",
-                    "character": character,
-                    "expression": expression,
-                    "location": current_location,
-                    "time": current_time
-                })
-                continue
+            if first_char == '<':
+                image_match = IMAGE_TAG_RE.match(line)
+                if image_match:
+                    character = image_match.group(1).strip()
+                    expression = image_match.group(2).strip()
+                    
+                    segments.append({
+                        "type": "image",
+                        "character": character,
+                        "expression": expression,
+                        "location": current_location,
+                        "time": current_time
+                    })
+                    continue
+            
+            # 解析选项内容 (选项1: "文字" → [效果])
+            # 选项行本身含冒号，必须先于对话规则检查，否则会被当成说话人为"选项1"的对话
+            if first_char == '选':
+                choice_match = _CHOICE_OPTION_RE.match(line)
+                if choice_match:
+                    choice_num = int(choice_match.group(1))
+                    choice_text = choice_match.group(2).strip()
+                    effects_str = choice_match.group(3).strip()
+                    
+                    # 解析效果
+                    effects = self._parse_choice_effects(effects_str)
+                    
+                    segments.append({
+                        "type": "choice_option",
+                        "number": choice_num,
+                        "text": choice_text,
+                        "effects": effects
+                    })
+                    continue
             
-            # 解析对话 (角色名: "对话内容")
-            dialogue_match = re.match(r'([^:]+):\s*"?(.+?)"?$', line)
-            if dialogue_match:
-                speaker = dialogue_match.group(1).strip()
-                text = dialogue_match.group(2).strip()
+            # 解析对话 (角色名: "对话内容")，引号可省略
+            colon = line.find(':')
+            if colon > 0 and colon < len(line) - 1:
+                speaker = line[:colon].strip()
+                text = line[colon + 1:].lstrip()
+                if text[0] == '"' and len(text) > 1:
+                    text = text[1:]
+                if text[-1] == '"' and len(text) > 1:
+                    text = text[:-1]
+                text = text.strip()
                 segments.append({
                     "type": "dialogue",
                     "speaker": speaker if speaker != "NARRATOR" else None,
@@ -300,28 +519,42 @@ class WriterAgent:
                     "time": current_time
                 })
                 continue
-            
-            # 解析选项内容 (选项1: "文字" → [效果])
-            choice_match = re.match(r'选项(\d+):\s*"(.+?)"\s*→\s*\[(.+?)\]', line)
-            if choice_match:
-                choice_num = int(choice_match.group(1))
-                choice_text = choice_match.group(2).strip()
-                effects_str = choice_match.group(3).strip()
-                
-                # 解析效果
-                effects = self._parse_choice_effects(effects_str)
-                
-                segments.append({
-                    "type": "choice_option",
-                    "number": choice_num,
-                    "text": choice_text,
-                    "effects": effects
-                })
-                continue
         
         logger.info(f"✅ 解析完成: {len(segments)} 个片段")
         return segments
     
+    @staticmethod
+    def _parse_choice_effects(effects_str: str) -> Dict[str, int]:
+        """
+        解析选项效果，如 "小雪好感度+5, 金钱-100"
+        
+        效果都是"前缀 + 带符号整数"的固定格式，直接用字符串查找切分，无需正则
+        
+        Returns:
+            {角色名: 好感度变化, "money": 金钱变化}
+        """
+        effects = {}
+        for part in effects_str.split(','):
+            part = part.strip()
+            if not part or part == '无影响':
+                continue
+            
+            pos = part.find('好感度')
+            if pos > 0:
+                try:
+                    effects[part[:pos].strip()] = int(part[pos + 3:])
+                except ValueError:
+                    logger.warning(f"⚠️ 无法解析选项效果: {part}")
+                continue
+            
+            if part.startswith('金钱'):
+                try:
+                    effects['money'] = int(part[2:])
+                except ValueError:
+                    logger.warning(f"⚠️ 无法解析选项效果: {part}")
+        
+        return effects
+    
     def summarize_story(self, story_content: str) -> str:
         """
         生成剧情摘要
@@ -332,6 +565,15 @@ class WriterAgent:
         Returns:
             剧情摘要
         """
+        # 内容本身已经足够短时，摘要不会更短，直接返回省去一次 LLM 调用
+        if len(story_content) <= self.config.SUMMARY_MIN_LENGTH:
+            return story_content.strip()
+        
+        key = self._summary_key(story_content)
+        cached = self._summary_cache.get(key)
+        if cached is not None:
+            return cached
+        
         logger.info("📝 生成剧情摘要...")
         
         try:
@@ -345,8 +587,101 @@ class WriterAgent:
                 temperature=0.5
             )
             
-            return summary.strip()
+            summary = summary.strip()
+            self._remember_summary(key, summary)
+            return summary
             
         except Exception as e:
             logger.error(f"❌ 摘要生成失败: {str(e)}")
-            return story_content[-500:]  # 失败时回退到截取最后一段
+            return self._story_tail(story_content, 500)  # 失败时回退到截取最后一段
+    
+    def summarize_story_batch(self, story_contents: List[str], batch_size: Optional[int] = None) -> List[str]:
+        """
+        批量生成剧情摘要：每次请求合并多段剧情，减少调用次数
+        
+        Args:
+            story_contents: 剧情内容列表
+            batch_size: 每次请求包含的段数，默认使用配置值
+            
+        Returns:
+            与输入一一对应的摘要列表（批量结果缺失的段落单独补做）
+        """
+        batch_size = batch_size or self.config.SUMMARY_BATCH_SIZE
+        # 足够短的段落直接作为摘要，已缓存的直接复用，只有其余段落进入批量请求
+        summaries = [content.strip() for content in story_contents]
+        pending = []
+        for i, content in enumerate(story_contents):
+            if len(content) <= self.config.SUMMARY_MIN_LENGTH:
+                continue
+            cached = self._summary_cache.get(self._summary_key(content))
+            if cached is not None:
+                summaries[i] = cached
+            else:
+                pending.append(i)
+        
+        for offset in range(0, len(pending), batch_size):
+            indices = pending[offset:offset + batch_size]
+            batch = [story_contents[i] for i in indices]
+            if len(batch) == 1:
+                summaries[indices[0]] = self.summarize_story(batch[0])
+                continue
+            
+            logger.info(f"📝 批量生成剧情摘要 ({len(batch)} 段)...")
+            by_id = {}
+            try:
+                sections = "\n\n".join(
+                    f"### id={i}\n{content}" for i, content in enumerate(batch, 1)
+                )
+                prompt = self.config.SUMMARY_BATCH_PROMPT.format(count=len(batch), sections=sections)
+                response = self.llm_client.chat_completion(
+                    messages=[
+                        {"role": "system", "content": "你是一位擅长总结故事的助手。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.5
+                )
+                for item in JSONParser.parse_ai_response(response):
+                    if isinstance(item, dict) and item.get('summary'):
+                        by_id[str(item.get('id'))] = str(item['summary']).strip()
+            except Exception as e:
+                logger.error(f"❌ 批量摘要生成失败: {e}")
+            
+            for i, (index, content) in enumerate(zip(indices, batch), 1):
+                summary = by_id.get(str(i))
+                if summary:
+                    self._remember_summary(self._summary_key(content), summary)
+                    summaries[index] = summary
+                else:
+                    summaries[index] = self.summarize_story(content)
+        
+        return summaries
+    
+    @staticmethod
+    def _summary_key(story_content: str) -> bytes:
+        """摘要缓存键：剧情内容的 BLAKE2 摘要，避免长文本直接作为字典键"""
+        return hashlib.blake2b(story_content.encode('utf-8'), digest_size=16).digest()
+    
+    def _remember_summary(self, key: bytes, summary: str) -> None:
+        """写入摘要缓存，超出容量时淘汰最早写入的条目"""
+        with self._summary_cache_lock:
+            if len(self._summary_cache) >= self.config.SUMMARY_CACHE_SIZE:
+                self._summary_cache.pop(next(iter(self._summary_cache)), None)
+            self._summary_cache[key] = summary
+    
+    @staticmethod
+    def _story_tail(story: str, max_chars: int) -> str:
+        """
+        截取剧情末尾约 max_chars 个字符，起点对齐到场景或行的边界，避免从半句话开始
+        
+        只在截断点之后的一小段窗口内查找边界，找不到时按字符截断
+        """
+        if len(story) <= max_chars:
+            return story
+        
+        tail_start = len(story) - max_chars
+        boundary = story.find('\n<scene>', tail_start, tail_start + max_chars // 2)
+        if boundary == -1:
+            boundary = story.find('\n', tail_start, tail_start + max_chars // 4)
+        if boundary == -1:
+            return story[tail_start:]
+        return story[boundary + 1:]
@@ -52,6 +52,8 @@ class DataPaths:
     
     GAME_DESIGN_FILE = DATA_DIR / "game_design.json"
     STORY_FILE = DATA_DIR / "story.txt"
+    # 剧情解析结果缓存（随 story.txt 变化自动失效）
+    PARSED_STORY_CACHE = DATA_DIR / ".story.parsed.pkl"
     
     IMAGES_DIR = DATA_DIR / "images"
     BACKGROUNDS_DIR = IMAGES_DIR / "backgrounds"
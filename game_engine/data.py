@@ -1,8 +1,168 @@
+import io
 import json
+import logging
+import os
+import pickle
 import re
-from typing import Dict, List, Optional
+import sys
+from dataclasses import dataclass
+from typing import ClassVar, Dict, Iterable, List, Optional
 from .config import DataPaths
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选加速依赖，未安装时使用标准库 json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 剧情解析缓存的格式版本，StoryParser 输出结构变化时递增，使旧缓存失效
+_PARSED_STORY_CACHE_VERSION = 2
+
+# 节点头: === Node: node_id ===
+_NODE_HEADER_RE = re.compile(r'===\s*Node:\s*(.+?)\s*===', re.IGNORECASE)
+
+# --- 剧情行 ---
+# 每种行一个不可变的 slots 数据类：比字典省内存，字段访问是固定偏移；
+# 各类的 type 与原先字典中的 "type" 取值一致，场景仍按 line.type 分派
+@dataclass(frozen=True, slots=True)
+class StoryLine:
+    """剧情行基类"""
+    type: ClassVar[str]
+
+
+@dataclass(frozen=True, slots=True)
+class MarkerLine(StoryLine):
+    """[ELSE] / [ENDIF] / [CHOICE] 等无参数的控制标记"""
+    type: str
+
+
+@dataclass(frozen=True, slots=True)
+class SceneLine(StoryLine):
+    """切换背景"""
+    type: ClassVar[str] = "scene"
+    value: str
+
+
+@dataclass(frozen=True, slots=True)
+class IfLine(StoryLine):
+    """好感度条件分支"""
+    type: ClassVar[str] = "if"
+    condition_role: str
+    condition_level: int
+
+
+@dataclass(frozen=True, slots=True)
+class ImageLine(StoryLine):
+    """切换立绘，value 为 "角色名-表情" """
+    type: ClassVar[str] = "image"
+    value: str
+
+
+@dataclass(frozen=True, slots=True)
+class NarratorLine(StoryLine):
+    """旁白"""
+    type: ClassVar[str] = "narrator"
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class DialogueLine(StoryLine):
+    """角色对话"""
+    type: ClassVar[str] = "dialogue"
+    speaker: str
+    text: str
+    emotion: str = "neutral"
+
+
+@dataclass(frozen=True, slots=True)
+class JumpLine(StoryLine):
+    """无条件跳转到其他节点"""
+    type: ClassVar[str] = "jump"
+    target: str
+
+
+@dataclass(frozen=True, slots=True)
+class ChoiceLine(StoryLine):
+    """选择支中的一个选项"""
+    type: ClassVar[str] = "choice_option"
+    text: str
+    target: str
+
+
+# 各行处理函数对说话人、场景、立绘、跳转目标等在剧情中大量重复的值做 sys.intern：
+# 同名字符串全剧共用一个对象，比较时可直接按地址判等，pickle 缓存中也只存一份
+
+# 整行固定的控制标记，不可变，所有出现处共用同一个对象
+_FIXED_LINES = {
+    '[ELSE]': MarkerLine("else"),
+    '[ENDIF]': MarkerLine("endif"),
+    '[CHOICE]': MarkerLine("choice_start"),
+}
+
+
+def _scene_line(match: re.Match) -> SceneLine:
+    """<scene>场景名</scene>"""
+    return SceneLine(sys.intern(match.group('scene_value').strip()))
+
+
+def _if_line(match: re.Match) -> IfLine:
+    """[IF: Role >= Level]"""
+    return IfLine(sys.intern(match.group('if_role')), int(match.group('if_level')))
+
+
+def _image_line(match: re.Match) -> ImageLine:
+    """<image id="角色名">表情</image>"""
+    char_name = match.group('image_id')
+    expression = match.group('image_expr').strip()
+    return ImageLine(sys.intern(f"{char_name}-{expression}"))
+
+
+def _content_line(match: re.Match) -> StoryLine:
+    """<content id="xxx">内容</content> (统一格式，包括旁白和对话)"""
+    speaker = sys.intern(match.group('content_id').strip())
+    text = match.group('content_text').strip()
+    
+    # 旁白特殊处理
+    if speaker == "旁白":
+        return NarratorLine(text)
+    return DialogueLine(speaker, text)
+
+
+def _jump_line(match: re.Match) -> JumpLine:
+    """[JUMP: node_id]"""
+    return JumpLine(sys.intern(match.group('jump_target')))
+
+
+def _choice_line(match: re.Match) -> ChoiceLine:
+    """<choice target="node_id">选项文本</choice>"""
+    return ChoiceLine(
+        match.group('choice_text').strip(),
+        sys.intern(match.group('choice_target').strip())
+    )
+
+
+# 单行剧情的匹配规则：(规则名, 首字符, 正则, 处理函数)，同一首字符内顺序即匹配优先级
+_LINE_RULES = (
+    ('scene', '<', r'<scene>(?P<scene_value>.+?)</scene>', _scene_line),
+    ('if', '[', r'\[IF: (?P<if_role>.+?) >= (?P<if_level>\d+)\]', _if_line),
+    ('image', '<', r'<image\s+id="(?P<image_id>[^"]+)">(?P<image_expr>[^<]+)</image>', _image_line),
+    ('content', '<', r'<content\s+id="(?P<content_id>[^"]+)">(?P<content_text>[^<]+)</content>', _content_line),
+    ('jump', '[', r'\[JUMP: (?P<jump_target>.+?)\]', _jump_line),
+    ('choice', '<', r'<choice\s+target="(?P<choice_target>[^"]+)">(?P<choice_text>.+?)</choice>', _choice_line),
+)
+
+# 按首字符分组，每组规则合并为一个带命名分组的正则：
+# 每行先查表，首字符不可能命中的行（如 LLM 夹带的说明文字）直接跳过，其余只调用一次 match，按 lastgroup 分派
+_LINE_RES = {
+    prefix: re.compile('|'.join(
+        f'(?P<{name}>{pattern})' for name, rule_prefix, pattern, _ in _LINE_RULES if rule_prefix == prefix
+    ))
+    for prefix in dict.fromkeys(rule_prefix for _, rule_prefix, _, _ in _LINE_RULES)
+}
+_LINE_HANDLERS = {name: handler for name, _, _, handler in _LINE_RULES}
+
+
 # --- 游戏数据加载器 ---
 class GameDataLoader:
     """加载 AI 生成的游戏数据"""
@@ -10,22 +170,68 @@ class GameDataLoader:
     @staticmethod
     def load_game_design() -> Optional[Dict]:
         """加载游戏设计文档"""
-        if not DataPaths.GAME_DESIGN_FILE.exists():
+        # 直接打开，文件不存在时捕获异常，省去额外的 exists() stat 调用
+        try:
+            # orjson 直接解析字节，省去解码步骤
+            if orjson is not None:
+                return orjson.loads(DataPaths.GAME_DESIGN_FILE.read_bytes())
+            with open(DataPaths.GAME_DESIGN_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
             print(f"❌ 未找到游戏设计文件: {DataPaths.GAME_DESIGN_FILE}")
             return None
-        
-        with open(DataPaths.GAME_DESIGN_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
     
     @staticmethod
     def load_story() -> Optional[str]:
         """加载剧情脚本"""
-        if not DataPaths.STORY_FILE.exists():
+        try:
+            with open(DataPaths.STORY_FILE, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            print(f"❌ 未找到剧情文件: {DataPaths.STORY_FILE}")
+            return None
+    
+    @staticmethod
+    def load_parsed_story() -> Optional[Dict[str, List[StoryLine]]]:
+        """
+        加载解析后的剧情，优先使用磁盘缓存
+        
+        缓存以 (格式版本, 修改时间, 文件大小) 为键：剧情文件未变化时直接反序列化，
+        跳过读取和解析；缓存文件先写键再写结果，键不匹配时无需反序列化整个结果
+        """
+        try:
+            stat = DataPaths.STORY_FILE.stat()
+        except FileNotFoundError:
+            print(f"❌ 未找到剧情文件: {DataPaths.STORY_FILE}")
+            return None
+        key = (_PARSED_STORY_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        
+        # 缓存由游戏自身写入数据目录，损坏或版本不符时视为未命中
+        try:
+            with open(DataPaths.PARSED_STORY_CACHE, 'rb') as f:
+                if pickle.load(f) == key:
+                    return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError):
+            pass
+        
+        # 直接从文件流式解析，不先把整个剧情读成字符串
+        try:
+            with open(DataPaths.STORY_FILE, 'r', encoding='utf-8', buffering=1 << 20) as f:
+                parsed = StoryParser.parse_story_stream(f)
+        except FileNotFoundError:
             print(f"❌ 未找到剧情文件: {DataPaths.STORY_FILE}")
             return None
         
-        with open(DataPaths.STORY_FILE, 'r', encoding='utf-8') as f:
-            return f.read()
+        # 先写临时文件再替换，避免中断时留下半个缓存
+        temp_path = DataPaths.PARSED_STORY_CACHE.with_name(DataPaths.PARSED_STORY_CACHE.name + '.part')
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, DataPaths.PARSED_STORY_CACHE)
+        except OSError as e:
+            print(f"⚠️ 写入剧情解析缓存失败: {e}")
+        return parsed
 
 
 # --- 剧情脚本解析器 ---
@@ -33,7 +239,7 @@ class StoryParser:
     """解析 AI 生成的剧情脚本"""
     
     @staticmethod
-    def parse_story(story_text: str) -> Dict[str, List[Dict]]:
+    def parse_story(story_text: str) -> Dict[str, List[StoryLine]]:
         """
         解析剧情文本为结构化数据 (DAG-based)
         
@@ -42,12 +248,20 @@ class StoryParser:
             "node_id": [lines...]
         }
         """
+        # StringIO 逐行迭代，不再额外生成整份行列表
+        return StoryParser.parse_story_stream(io.StringIO(story_text))
+    
+    @staticmethod
+    def parse_story_stream(lines: Iterable[str]) -> Dict[str, List[StoryLine]]:
+        """
+        逐行解析剧情，lines 可以是打开的剧情文件等任意行迭代器
+        
+        返回格式与 parse_story 相同
+        """
         nodes = {}
         current_node_id = None
         current_lines = []
         
-        lines = story_text.strip().split('\n')
-        
         for line in lines:
             line = line.strip()
             
@@ -56,15 +270,16 @@ class StoryParser:
                 continue
             
             # 匹配节点头: === Node: node_id ===
-            node_match = re.match(r'===\s*Node:\s*(.+?)\s*===', line, re.IGNORECASE)
+            node_match = _NODE_HEADER_RE.match(line)
             if node_match:
                 # 保存上一个节点
                 if current_node_id:
                     nodes[current_node_id] = current_lines
                 
-                current_node_id = node_match.group(1).strip()
+                current_node_id = sys.intern(node_match.group(1).strip())
                 current_lines = []
-                print(f"📖 解析 Node: {current_node_id}")
+                # 每个节点一条，走 DEBUG 日志，正常运行时不产生输出
+                logger.debug("📖 解析 Node: %s", current_node_id)
                 continue
             
             # 解析行内容
@@ -80,67 +295,17 @@ class StoryParser:
         return nodes
     
     @staticmethod
-    def _parse_line(line: str) -> Optional[Dict]:
+    def _parse_line(line: str) -> Optional[StoryLine]:
         """解析单行剧情"""
-        # <scene>场景名</scene>
-        scene_tag_match = re.match(r'<scene>(.+?)</scene>', line)
-        if scene_tag_match:
-            return {"type": "scene", "value": scene_tag_match.group(1).strip()}
-
-        # [IF: Role >= Level]
-        if_match = re.match(r'\[IF: (.+?) >= (\d+)\]', line)
-        if if_match:
-            return {
-                "type": "if",
-                "condition_role": if_match.group(1),
-                "condition_level": int(if_match.group(2))
-            }
-            
-        # [ELSE]
-        if line == '[ELSE]':
-            return {"type": "else"}
-            
-        # [ENDIF]
-        if line == '[ENDIF]':
-            return {"type": "endif"}
-
-        # <image id="角色名">表情</image>
-        image_match = re.match(r'<image\s+id="([^"]+)">([^<]+)</image>', line)
-        if image_match:
-            char_name = image_match.group(1)
-            expression = image_match.group(2).strip()
-            return {"type": "image", "value": f"{char_name}-{expression}"}
-        
-        # <content id="xxx">内容</content> (统一格式，包括旁白和对话)
-        content_match = re.match(r'<content\s+id="([^"]+)">([^<]+)</content>', line)
-        if content_match:
-            speaker = content_match.group(1).strip()
-            text = content_match.group(2).strip()
-            
-            # 旁白特殊处理
-            if speaker == "旁白":
-                return {"type": "narrator", "text": text}
-            else:
-                return {"type": "dialogue", "speaker": speaker, "text": text, "emotion": "neutral"}
-        
-        # [JUMP: node_id]
-        jump_match = re.match(r'\[JUMP: (.+?)\]', line)
-        if jump_match:
-            return {"type": "jump", "target": jump_match.group(1)}
-
-        # [CHOICE]
-        if line == '[CHOICE]':
-            return {"type": "choice_start"}
+        # [ELSE] / [ENDIF] / [CHOICE]
+        fixed_line = _FIXED_LINES.get(line)
+        if fixed_line:
+            return fixed_line
         
-        # <choice target="node_id">选项文本</choice>
-        xml_choice_match = re.match(r'<choice\s+target="([^"]+)">(.+?)</choice>', line)
-        if xml_choice_match:
-            return {
-                "type": "choice_option",
-                "index": None,
-                "text": xml_choice_match.group(2).strip(),
-                "target": xml_choice_match.group(1).strip()
-            }
+        line_re = _LINE_RES.get(line[:1])
+        match = line_re.match(line) if line_re else None
+        if match:
+            return _LINE_HANDLERS[match.lastgroup](match)
         
         # Unknown line type
         return None
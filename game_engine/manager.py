@@ -1,30 +1,96 @@
 import pygame
+import os
 import sys
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
 
-from .config import SCREEN_WIDTH, SCREEN_HEIGHT, FPS
-from .data import GameDataLoader, StoryParser
+from .config import SCREEN_WIDTH, SCREEN_HEIGHT, FPS, DataPaths
+from .data import GameDataLoader
 from .state import GameState
 from .scenes import TitleScene, DialogueScene
 
+# --- 图像资源缓存 ---
+class AssetCache:
+    """
+    立绘与背景图像缓存，各场景共享
+    
+    图像按 (路径, 尺寸) 缓存为已缩放、已转换为显示格式的 Surface，
+    首次出场时不再解码 PNG，每帧 blit 也无需格式转换
+    """
+    CHARACTER_SIZE = (400, 600)
+    BACKGROUND_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    
+    def __init__(self):
+        self._images: Dict[Tuple[Path, Tuple[int, int]], pygame.Surface] = {}
+    
+    def preload_all(self):
+        """预加载全部角色立绘和场景背景"""
+        jobs = [(path, self.CHARACTER_SIZE, True) for path in DataPaths.CHARACTERS_DIR.glob("*/*.png")]
+        jobs += [(path, self.BACKGROUND_SIZE, False) for path in DataPaths.BACKGROUNDS_DIR.glob("*.png")]
+        self.preload(jobs)
+    
+    def preload(self, jobs: Iterable[Tuple[Path, Tuple[int, int], bool]]):
+        """
+        并行解码并缩放图像（SDL_image 解码时释放 GIL），每张原图缩放后即可释放；
+        转换显示格式依赖显示表面，在主线程按完成顺序逐张进行
+        
+        Args:
+            jobs: [(图像路径, 目标尺寸, 是否带透明通道), ...]
+        """
+        jobs = [job for job in jobs if (job[0], job[1]) not in self._images]
+        if not jobs:
+            return
+        
+        with ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="assets") as executor:
+            futures = {executor.submit(self._load_scaled, path, size): (path, size, alpha) for path, size, alpha in jobs}
+            for future in as_completed(futures):
+                path, size, alpha = futures[future]
+                image = future.result()
+                if image is not None:
+                    self._images[(path, size)] = self._convert(image, alpha)
+        print(f"🖼️ 预加载图像: {len(self._images)} 张")
+    
+    def get(self, path: Path, size: Tuple[int, int], alpha: bool) -> Optional[pygame.Surface]:
+        """获取图像，未预加载时同步加载并缓存"""
+        image = self._images.get((path, size))
+        if image is None:
+            scaled = self._load_scaled(path, size)
+            if scaled is None:
+                return None
+            image = self._images[(path, size)] = self._convert(scaled, alpha)
+        return image
+    
+    @staticmethod
+    def _load_scaled(path: Path, size: Tuple[int, int]) -> Optional[pygame.Surface]:
+        """解码图像文件并缩放到目标尺寸，失败返回 None"""
+        try:
+            raw = pygame.image.load(str(path))
+        except Exception as e:
+            print(f"⚠️ 加载图像失败 {path}: {e}")
+            return None
+        return pygame.transform.scale(raw, size)
+    
+    @staticmethod
+    def _convert(image: pygame.Surface, alpha: bool) -> pygame.Surface:
+        """转换为与屏幕一致的像素格式"""
+        return image.convert_alpha() if alpha else image.convert()
+
+
 # --- 游戏管理器 ---
 class GameManager:
     """游戏管理器"""
     
     def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("AI Visual Novel Engine")
-        self.clock = pygame.time.Clock()
+        # pygame 与窗口在首次需要画面时才初始化（见 _ensure_display），
+        # 只加载/检查游戏数据的调用方无需承担显示初始化的开销
+        self.screen = None
+        self.clock = None
         self.running = True
         
-        # 加载游戏数据
+        # 加载游戏数据（包括解析后的剧情）
         self.load_game_data()
-        
-        # 解析剧情
-        self.parsed_story = {}
-        if self.story_text:
-            self.parsed_story = StoryParser.parse_story(self.story_text)
+        self.assets = AssetCache()
         
         # 创建游戏状态
         if self.game_design:
@@ -34,20 +100,37 @@ class GameManager:
             print("⚠️ 游戏设计文档缺失，无法启动")
             self.game_state = None
         
-        # 开始场景
-        self.current_scene = TitleScene(self)
+        # 场景需要字体和显示格式，创建窗口后再进入标题场景
+        self.current_scene = None
+    
+    def _ensure_display(self):
+        """首次调用时初始化 pygame 并创建窗口，之后直接返回"""
+        if self.screen is not None:
+            return
+        pygame.init()
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("AI Visual Novel Engine")
+        self.clock = pygame.time.Clock()
+        
+        # 预加载立绘和背景，避免角色首次出场时卡顿（格式转换依赖已创建的显示）
+        self.assets.preload_all()
     
     def load_game_data(self):
         """加载所有游戏数据"""
         print("📚 加载游戏数据...")
         
-        self.game_design = GameDataLoader.load_game_design()
-        self.story_text = GameDataLoader.load_story()
+        # 设计文档与剧情互不依赖，并行读取以重叠文件 I/O
+        # （剧情文件未变化时直接使用解析缓存）
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load") as executor:
+            design_future = executor.submit(GameDataLoader.load_game_design)
+            story_future = executor.submit(GameDataLoader.load_parsed_story)
+            self.game_design = design_future.result()
+            self.parsed_story = story_future.result() or {}
         
         if self.game_design:
             print(f"✅ 游戏标题: {self.game_design.get('title')}")
-        if self.story_text:
-            print(f"✅ 剧情长度: {len(self.story_text)} 字符")
+        if self.parsed_story:
+            print(f"✅ 剧情节点: {len(self.parsed_story)} 个")
 
     def get_character_id(self, name: str) -> Optional[str]:
         """根据名字获取角色ID"""
@@ -87,6 +170,7 @@ class GameManager:
             # 尝试查找是否有默认结局或提示
             return
             
+        self._ensure_display()
         lines = self.parsed_story[node_id]
         scene_name = f"Node: {node_id}"
         print(f"▶️  播放节点: {node_id} ({len(lines)} 行)")
@@ -101,6 +185,9 @@ class GameManager:
     def run(self):
         """主循环"""
         print("\n🎮 游戏启动！")
+        self._ensure_display()
+        if self.current_scene is None:
+            self.current_scene = TitleScene(self)
         
         while self.running:
             for event in pygame.event.get():
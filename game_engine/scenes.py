@@ -3,14 +3,20 @@ import sys
 import math
 import textwrap
 import re
-from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 from .config import Colors, SCREEN_WIDTH, SCREEN_HEIGHT, DataPaths
-from .ui import Button, get_font, draw_panel
+from .data import StoryLine
+from .ui import Button, GlyphAtlas, get_font, draw_panel
 
 if TYPE_CHECKING:
     from .manager import GameManager
 
+# 对话面板布局
+DIALOGUE_PANEL_HEIGHT = 220
+DIALOGUE_PANEL_RECT = (50, SCREEN_HEIGHT - DIALOGUE_PANEL_HEIGHT - 30, SCREEN_WIDTH - 100, DIALOGUE_PANEL_HEIGHT)
+DIALOGUE_TEXT_MAX_WIDTH = DIALOGUE_PANEL_RECT[2] - 80  # 对话框内部边距
+
 # --- 场景基类 ---
 class Scene:
     def __init__(self, manager: 'GameManager'):
@@ -107,7 +113,7 @@ class TitleScene(Scene):
 class DialogueScene(Scene):
     """对话场景 - 支持 AI 生成的剧情"""
     
-    def __init__(self, manager: 'GameManager', script_lines: List[Dict], scene_name: str = ""):
+    def __init__(self, manager: 'GameManager', script_lines: List[StoryLine], scene_name: str = ""):
         super().__init__(manager)
         self.script_lines = script_lines
         self.scene_name = scene_name
@@ -117,6 +123,7 @@ class DialogueScene(Scene):
         self.font_name = get_font(30, bold=True)
         
         self.full_text = ""
+        self.text_layout: List[Tuple[int, str]] = []  # 换行结果 [(行首在 full_text 中的位置, 行文本), ...]
         self.current_display_text = ""
         self.char_counter = 0
         self.typing_speed = 1.5
@@ -158,13 +165,11 @@ class DialogueScene(Scene):
                     break
         
         if bg_path.exists():
-            try:
-                image = pygame.image.load(str(bg_path))
-                image = pygame.transform.scale(image, (SCREEN_WIDTH, SCREEN_HEIGHT))
+            assets = self.manager.assets
+            image = assets.get(bg_path, assets.BACKGROUND_SIZE, alpha=False)
+            if image:
                 self.background_images[bg_name] = image
                 return image
-            except Exception as e:
-                print(f"⚠️ 加载背景失败 {bg_path}: {e}")
         
         return None
 
@@ -184,15 +189,12 @@ class DialogueScene(Scene):
             image_path = char_dir / "neutral.png"
         
         if image_path.exists():
-            try:
-                image = pygame.image.load(str(image_path))
-                # 缩放到合适大小 (例如 400x600)
-                image = pygame.transform.scale(image, (400, 600))
+            # 缩放到合适大小 (例如 400x600)，由共享缓存负责解码与格式转换
+            assets = self.manager.assets
+            image = assets.get(image_path, assets.CHARACTER_SIZE, alpha=True)
+            if image:
                 self.character_images[cache_key] = image
-                return image
-            except Exception as e:
-                print(f"⚠️ 加载图像失败 {image_path}: {e}")
-                return None
+            return image
         
         return None
     
@@ -203,13 +205,13 @@ class DialogueScene(Scene):
             return
         
         line = self.script_lines[self.index]
-        line_type = line.get("type")
+        line_type = line.type
         
         # --- 常规剧情指令 ---
         
         # 处理背景/场景
         if line_type == "background" or line_type == "scene":
-            bg_name = line.get("value", "").strip()
+            bg_name = line.value.strip()
             self.current_bg_name = bg_name 
             bg_image = self.load_background_image(bg_name)
             if bg_image:
@@ -224,7 +226,7 @@ class DialogueScene(Scene):
 
         # 处理图像
         if line_type == "image":
-            image_value = line.get("value", "").strip()
+            image_value = line.value.strip()
             self.current_char_name = image_value 
             
             # 如果是"无"或空，清除立绘
@@ -255,22 +257,22 @@ class DialogueScene(Scene):
         elif line_type == "narrator":
             self.current_speaker = None
             self.current_character_image = None 
-            self.full_text = line.get("text", "") 
+            self.full_text = line.text
         
         # 处理对话
         elif line_type == "dialogue":
-            speaker_id = line.get("speaker")
+            speaker_id = line.speaker
             
             if speaker_id == "主角":
                 self.current_speaker = "我"
             else:
                 self.current_speaker = self._get_character_name(speaker_id)
             
-            self.full_text = line.get("text", "")
+            self.full_text = line.text
         
         # 处理跳转
         elif line_type == "jump":
-            target_node = line.get("target")
+            target_node = line.target
             print(f"🦘 跳转到节点: {target_node}")
             self.manager.game_state.current_node_id = target_node
             self.manager.play_current_scene() 
@@ -288,7 +290,7 @@ class DialogueScene(Scene):
                 
                 while temp_index < len(self.script_lines):
                     next_line = self.script_lines[temp_index]
-                    if next_line and next_line.get("type") == "choice_option":
+                    if next_line.type == "choice_option":
                         self.choice_options.append(next_line)
                         temp_index += 1
                     else:
@@ -307,6 +309,9 @@ class DialogueScene(Scene):
             self.load_line()
             return
         
+        # 整行文本只换行一次，打字机效果逐帧显示其前缀
+        self.text_layout = self._layout_text(self.full_text, DIALOGUE_TEXT_MAX_WIDTH)
+        
         # 重置打字机
         self.current_display_text = ""
         self.char_counter = 0
@@ -327,24 +332,20 @@ class DialogueScene(Scene):
         }
         return id_map.get(character_id.upper(), character_id)
 
-    def _wrap_text_pixels(self, text, max_width):
-        """基于像素宽度的精准换行"""
-        lines = []
-        # 按空格切分单词（针对英文），中文则需要逐字检查或混合处理
-        # 简单的混合处理逻辑：
-        current_line = ""
-        for char in text:
-            test_line = current_line + char
-            # 使用 font.size() 获取像素宽度
-            if self.font_text.size(test_line)[0] <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = char
-        if current_line:
-            lines.append(current_line)
-        return lines
+    def _layout_text(self, text: str, max_width: int) -> List[Tuple[int, str]]:
+        """
+        按段落和像素宽度换行，记录每行在原文中的起始位置
+        
+        逐字贪心换行对前缀稳定：打字机显示的前缀与完整文本的换行位置一致，因此只需计算一次
+        """
+        layout = []
+        start = 0
+        for paragraph in text.split('\n'):
+            for line in GlyphAtlas.wrap(self.font_text, Colors.UI_TEXT, paragraph, max_width):
+                layout.append((start, line))
+                start += len(line)
+            start += 1  # 换行符
+        return layout
 
     def _get_character_id(self, character_name: str) -> Optional[str]:
         """根据名称获取角色 ID"""
@@ -369,7 +370,7 @@ class DialogueScene(Scene):
             button_width = 600
             button_x = (SCREEN_WIDTH - button_width) // 2
             
-            text = f"{i+1}. {choice.get('text')}"
+            text = f"{i+1}. {choice.text}"
             
             btn = Button(
                 button_x, button_y, button_width, button_height,
@@ -382,12 +383,12 @@ class DialogueScene(Scene):
         """做出选择"""
         if choice_index < len(self.choice_options):
             choice = self.choice_options[choice_index]
-            target = choice.get("target")
+            target = choice.target
             
             # 记录选择
             self.manager.game_state.choices_made.append({
                 "scene": self.scene_name,
-                "choice": choice.get("text"),
+                "choice": choice.text,
                 "target": target
             })
             
@@ -466,35 +467,29 @@ class DialogueScene(Scene):
             screen.blit(self.current_character_image, (char_x, char_y))
         
         # 绘制对话面板
-        panel_height = 220
-        panel_rect = (50, SCREEN_HEIGHT - panel_height - 30, SCREEN_WIDTH - 100, panel_height)
+        panel_rect = DIALOGUE_PANEL_RECT
         draw_panel(screen, panel_rect)
         
         # 绘制说话人名字
         if self.current_speaker:
-            name_surf = self.font_name.render(self.current_speaker, True, Colors.WHITE)
-            name_w = name_surf.get_width() + 40
+            name_w = GlyphAtlas.width(self.font_name, Colors.WHITE, self.current_speaker) + 40
             name_rect = (panel_rect[0], panel_rect[1] - 40, name_w, 50)
             
             speaker_color = Colors.CHAR_ME if self.current_speaker in ["我", "Me"] else Colors.BTN_NORMAL
             pygame.draw.rect(screen, speaker_color, name_rect, border_top_left_radius=10, border_top_right_radius=10)
             
-            screen.blit(name_surf, (name_rect[0] + 20, name_rect[1] + 10))
+            GlyphAtlas.blit_text(screen, self.font_name, Colors.WHITE, self.current_speaker, (name_rect[0] + 20, name_rect[1] + 10))
         
-        # 绘制文本
+        # 绘制文本（使用预先计算的换行结果，只显示打字机已输出的部分）
         if not self.in_choice:
             text_start_y = panel_rect[1] + 30
-            paragraphs = self.current_display_text.split('\n')
-            
-            # 对话框内部边距
-            max_w = panel_rect[2] - 80
+            visible = len(self.current_display_text)
             
-            for p in paragraphs:
-                wrapped_lines = self._wrap_text_pixels(p, max_w)
-                for w_line in wrapped_lines:
-                    text_surf = self.font_text.render(w_line, True, Colors.UI_TEXT)
-                    screen.blit(text_surf, (panel_rect[0] + 40, text_start_y))
-                    text_start_y += 35
+            for line_start, line in self.text_layout:
+                if line_start >= visible:
+                    break
+                GlyphAtlas.blit_text(screen, self.font_text, Colors.UI_TEXT, line[:visible - line_start], (panel_rect[0] + 40, text_start_y))
+                text_start_y += 35
             
             # 继续指示器
             if self.finished_typing:
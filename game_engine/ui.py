@@ -1,10 +1,13 @@
 import pygame
 import os
+import functools
+from typing import Dict, List, Tuple
 from .config import Colors
 
 # 字体配置
+@functools.lru_cache(maxsize=None)
 def get_font(size, bold=False):
-    """获取合适的中文字体"""
+    """获取合适的中文字体（同一字号只加载一次，各场景共用同一个 Font 对象）"""
     local_fonts = ['SourceHanSansCN-Regular.otf', 'font.ttf', 'SimHei.ttf']
     for font_file in local_fonts:
         if os.path.exists(font_file):
@@ -27,6 +30,63 @@ def get_font(size, bold=False):
     return pygame.font.SysFont('microsoftyahei', size, bold=bold)
 
 
+# --- 字形缓存 ---
+class GlyphAtlas:
+    """
+    按 (字体, 颜色) 缓存单字渲染结果，绘制时逐字 blit 拼出文本
+    
+    每个字只光栅化一次，之后每帧只做内存拷贝；打字机效果下文本逐帧变化也无需重新 render
+    """
+    _glyphs: Dict[Tuple[pygame.font.Font, Tuple[int, ...]], Dict[str, pygame.Surface]] = {}
+    
+    @classmethod
+    def glyph(cls, font: pygame.font.Font, color, char: str) -> pygame.Surface:
+        """获取单个字符的渲染结果，首次使用时渲染并缓存"""
+        table = cls._glyphs.setdefault((font, tuple(color)), {})
+        surf = table.get(char)
+        if surf is None:
+            try:
+                surf = font.render(char, True, color)
+            except pygame.error:  # 零宽字符无法单独渲染
+                surf = pygame.Surface((0, font.get_height()), pygame.SRCALPHA)
+            table[char] = surf
+        return surf
+    
+    @classmethod
+    def width(cls, font: pygame.font.Font, color, text: str) -> int:
+        """文本的像素宽度（各字宽度之和）"""
+        return sum(cls.glyph(font, color, char).get_width() for char in text)
+    
+    @classmethod
+    def wrap(cls, font: pygame.font.Font, color, text: str, max_width: int) -> List[str]:
+        """基于像素宽度逐字换行，累加字宽，每个字只测量一次"""
+        lines = []
+        current_line = ""
+        current_width = 0
+        for char in text:
+            char_width = cls.glyph(font, color, char).get_width()
+            if current_width + char_width <= max_width:
+                current_line += char
+                current_width += char_width
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = char
+                current_width = char_width
+        if current_line:
+            lines.append(current_line)
+        return lines
+    
+    @classmethod
+    def blit_text(cls, surface: pygame.Surface, font: pygame.font.Font, color, text: str, pos) -> None:
+        """从 pos 开始逐字绘制一行文本"""
+        x, y = pos
+        for char in text:
+            glyph = cls.glyph(font, color, char)
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
+
+
 # --- 辅助绘图函数 ---
 def draw_panel(surface, rect, alpha=230):
     """绘制通用的 UI 面板（带圆角和阴影）"""
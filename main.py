@@ -12,7 +12,10 @@ AI 驱动的自动化 Visual Novel 生成和运行系统
 
 import sys
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
 import argparse
 from pathlib import Path
 
@@ -24,13 +27,31 @@ from agents.config import ProducerConfig, DesignerConfig, PathConfig
 
 
 def setup_logging(level=logging.INFO):
-    """配置日志系统"""
+    """
+    配置日志系统
+    
+    日志文件由后台 QueueListener 线程写入，调用方只把记录放入内存队列，
+    游戏循环和生成流程不会因为磁盘写入而阻塞；退出时 listener.stop() 写完剩余记录
+    """
+    PathConfig.ensure_directories()
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    
+    file_handler = logging.FileHandler(os.path.join(PathConfig.LOG_DIR, 'ai_visual_novel.log'), encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(log_format))
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # QueueHandler 入队前只合并消息本身，完整格式由文件 handler 负责，避免被 basicConfig 套用两次
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    
     logging.basicConfig(
         level=level,
         format=log_format,
         handlers=[
-            logging.FileHandler(os.path.join(PathConfig.LOG_DIR, 'ai_visual_novel.log'), encoding='utf-8'),
+            queue_handler,
             logging.StreamHandler(sys.stdout)
         ]
     )
@@ -0,0 +1,78 @@
+"""
+LLMClient 并发名额测试
+"""
+
+import sys
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from agents.llm_client import LLMClient
+
+
+class FakeStream:
+    """模拟 OpenAI Stream，记录是否被关闭"""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.streams = []
+
+    def create(self, stream=False, **kwargs):
+        if stream:
+            self.streams.append(FakeStream(["第一段", "第二段"]))
+            return self.streams[-1]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="完成"))])
+
+
+class RequestSlotsTest(unittest.TestCase):
+    """流式与非流式调用共享并发名额"""
+
+    def setUp(self):
+        # 跳过 __init__，不创建真实客户端
+        self.client = LLMClient.__new__(LLMClient)
+        self.client.provider = "openai"
+        self.client.cache_dir = None
+        self.completions = FakeCompletions()
+        self.client.client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        self.client._request_slots = threading.BoundedSemaphore(1)
+
+    def test_open_stream_does_not_block_chat_completion(self):
+        messages = [{"role": "user", "content": "你好"}]
+        stream = self.client.chat_completion_stream(messages)
+        self.assertEqual(next(stream), "第一段")
+
+        # 流尚未读完时，非流式调用也能拿到唯一的名额
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.client.chat_completion(messages)), daemon=True)
+        worker.start()
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(results, ["完成"])
+
+        self.assertEqual(list(stream), ["第二段"])
+
+    def test_closing_generator_closes_stream(self):
+        stream = self.client.chat_completion_stream([{"role": "user", "content": "你好"}])
+        next(stream)
+        stream.close()
+        self.assertTrue(self.completions.streams[0].closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
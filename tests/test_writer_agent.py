@@ -0,0 +1,47 @@
+"""
+WriterAgent 剧情解析测试
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from agents.writer_agent import WriterAgent
+
+
+class ParseStoryForUITest(unittest.TestCase):
+    """parse_story_for_ui 解析结果"""
+
+    def setUp(self):
+        # 解析不依赖 LLM 客户端，跳过 __init__
+        self.writer = WriterAgent.__new__(WriterAgent)
+
+    def test_choice_option_is_not_parsed_as_dialogue(self):
+        story = (
+            '## 教室 - 放学后\n'
+            '小雪: "一起去图书馆吗？"\n'
+            '[CHOICE]\n'
+            '选项1: "去图书馆" → [小雪好感度+5, 金钱-100]\n'
+            '选项2: "回家" → [无影响]\n'
+        )
+        segments = self.writer.parse_story_for_ui(story)
+
+        self.assertEqual(
+            [segment["type"] for segment in segments],
+            ["scene", "dialogue", "choice_start", "choice_option", "choice_option"]
+        )
+        self.assertEqual(segments[1]["speaker"], "小雪")
+        self.assertEqual(segments[3], {
+            "type": "choice_option",
+            "number": 1,
+            "text": "去图书馆",
+            "effects": {"小雪": 5, "money": -100}
+        })
+        self.assertEqual(segments[4]["effects"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
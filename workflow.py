@@ -4,6 +4,7 @@ Workflow Controller
 协调各个 Agent 的执行流程，管理整个游戏生成和运行的生命周期
 """
 
+import itertools
 import logging
 import json
 import os
@@ -13,15 +14,17 @@ from typing import Dict, Any, Optional, List
 import time
 from pathlib import Path
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from agents.producer_agent import ProducerAgent
 from agents.designer_agent import DesignerAgent
 from agents.artist_agent import ArtistAgent
 from agents.writer_agent import WriterAgent
 from agents.actor_agent import ActorAgent
-from agents.config import PathConfig, APIConfig, WriterConfig, DesignerConfig
+from agents.config import PathConfig, APIConfig, ArtistConfig, WriterConfig, DesignerConfig, STANDARD_EXPRESSIONS
 from agents.story_graph import StoryGraph
-from game_engine.data import StoryParser
+from agents.utils import IMAGE_TAG_RE, FileHelper
 
 # 常量定义
 logger = logging.getLogger(__name__)
@@ -41,6 +44,9 @@ class WorkflowController:
         self.writer = None
         self.actors = {}  # 存储所有演员 Agent: {name: ActorAgent}
         self.expressions_db = self._load_expressions()  # 表情库管理
+        # 同层节点并行生成时，表情库与剧本文件的写入需要互斥
+        self._expressions_lock = threading.Lock()
+        self._story_lock = threading.Lock()
         
         self.game_design = None
         
@@ -173,6 +179,18 @@ class WorkflowController:
             
             self._initialize_actors()
             
+            # 场景背景只依赖游戏设计，提前在后台线程生成，与剧本创作并行
+            logger.info("   🎨 后台开始生成场景背景...")
+            locations = [scene['name'] for scene in self.game_design.get('scenes', [])]
+            background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backgrounds")
+            backgrounds_future = background_executor.submit(
+                self.artist.generate_all_backgrounds,
+                locations,
+                story_background=self.game_design.get('background'),
+                art_style=self.game_design.get('art_style')
+            )
+            background_executor.shutdown(wait=False)
+            
             # Step 3: 生成完整故事
             logger.info(f"\n【Step 3/6】生成完整故事 (DAG-based)...")
             self._generate_full_story()
@@ -184,19 +202,14 @@ class WorkflowController:
             # Step 5: 生成所有美术资源 (背景 + 立绘)
             logger.info("\n【Step 5/6】生成美术资源 (背景 + 角色立绘)...")
             
-            # 2. 生成场景背景
-            logger.info("   🎨 生成场景背景...")
-            locations = [scene['name'] for scene in self.game_design.get('scenes', [])]
-            self.artist.generate_all_backgrounds(
-                locations,
-                story_background=self.game_design.get('background'),
-                art_style=self.game_design.get('art_style')
-            )
-            
-            # 3. 生成所有角色立绘
+            # 1. 生成所有角色立绘（背景仍在后台生成）
             logger.info("   👥 生成所有角色立绘...")
             self._generate_character_assets()
             
+            # 2. 等待场景背景完成
+            logger.info("   🎨 等待场景背景生成完成...")
+            backgrounds_future.result()
+            
             # Step 6: 生成标题画面 (此时已有所有美术资源)
             logger.info("\n【Step 6/6】生成标题画面...")
             character_ref_images = []
@@ -390,36 +403,24 @@ class WorkflowController:
         if not style_reference_image:
             logger.warning("      ⚠️  主角 neutral 不存在，其他角色将独立生成")
         
-        # 生成其他角色的 neutral
-        for char_name, actor in self.actors.items():
-            if actor.character_info.get('is_protagonist', False):
-                continue  # 主角已处理
-            
-            logger.info(f"      👤 生成角色 {char_name} 的 neutral...")
-            
-            char_id = actor.character_info.get('id', actor.name)
-            char_dir = os.path.join(PathConfig.CHARACTERS_DIR, char_id)
-            neutral_path = os.path.join(char_dir, "neutral.png")
-            
-            if os.path.exists(neutral_path):
-                logger.info(f"         ✅ 已存在")
-            else:
-                logger.info(f"         🎨 生成中...")
-                neutral_path = self._generate_expression_with_critique(
-                    actor=actor,
-                    expression="neutral",
-                    reference_image_path=style_reference_image,
-                    additional_feedback="Match the art style of the protagonist." if style_reference_image else ""
-                )
-                
-                if neutral_path:
-                    logger.info(f"         ✅ 生成完成")
-                else:
-                    logger.error(f"         ❌ 生成失败（API 调用失败）")
+        # 生成其他角色的 neutral（只依赖主角风格参考，各角色之间互不依赖，并行生成）
+        other_actors = [
+            (char_name, actor) for char_name, actor in self.actors.items()
+            if not actor.character_info.get('is_protagonist', False)  # 主角已处理
+        ]
+        with ThreadPoolExecutor(max_workers=ArtistConfig.MAX_PARALLEL_IMAGES, thread_name_prefix="portraits") as executor:
+            futures = [
+                executor.submit(self._generate_character_neutral, char_name, actor, style_reference_image)
+                for char_name, actor in other_actors
+            ]
+            for future in futures:
+                future.result()
         
         # 第二步：生成所有其他表情
         logger.info("   📋 第二阶段：生成所有其他表情")
         
+        # 每个表情只依赖该角色自己的 neutral，全部表情一起放入线程池
+        tasks = []
         for char_name, actor in self.actors.items():
             char_id = actor.character_info.get('id', actor.name)
             char_dir = os.path.join(PathConfig.CHARACTERS_DIR, char_id)
@@ -445,25 +446,58 @@ class WorkflowController:
                 if os.path.exists(img_path):
                     logger.info(f"         ✓ {expr} 已存在")
                     continue
-                
-                logger.info(f"         🎨 生成 {expr}...")
-                
-                # 让 Actor 描述这个表情
-                description = actor.generate_expression_description(expr)
-                additional_feedback = f"Expression description: {description}"
-                
-                # 使用审核循环生成
-                result_path = self._generate_expression_with_critique(
-                    actor=actor,
-                    expression=expr,
-                    reference_image_path=ref_path,
-                    additional_feedback=additional_feedback
-                )
-                
-                if result_path:
-                    logger.info(f"         ✅ {expr} 生成完成")
-                else:
-                    logger.error(f"         ❌ {expr} 生成失败")
+                tasks.append((char_name, actor, expr, ref_path))
+        
+        with ThreadPoolExecutor(max_workers=ArtistConfig.MAX_PARALLEL_IMAGES, thread_name_prefix="portraits") as executor:
+            futures = [executor.submit(self._generate_character_expression, *task) for task in tasks]
+            for future in futures:
+                future.result()
+    
+    def _generate_character_neutral(self, char_name: str, actor: ActorAgent, style_reference_image: Optional[str]):
+        """生成单个非主角角色的 neutral 表情（以主角 neutral 为风格参考）"""
+        logger.info(f"      👤 生成角色 {char_name} 的 neutral...")
+        
+        char_id = actor.character_info.get('id', actor.name)
+        char_dir = os.path.join(PathConfig.CHARACTERS_DIR, char_id)
+        neutral_path = os.path.join(char_dir, "neutral.png")
+        
+        if os.path.exists(neutral_path):
+            logger.info(f"         ✅ {char_name} 已存在")
+            return
+        
+        logger.info(f"         🎨 {char_name} 生成中...")
+        neutral_path = self._generate_expression_with_critique(
+            actor=actor,
+            expression="neutral",
+            reference_image_path=style_reference_image,
+            additional_feedback="Match the art style of the protagonist." if style_reference_image else ""
+        )
+        
+        if neutral_path:
+            logger.info(f"         ✅ {char_name} 生成完成")
+        else:
+            logger.error(f"         ❌ {char_name} 生成失败（API 调用失败）")
+    
+    def _generate_character_expression(self, char_name: str, actor: ActorAgent, expr: str, ref_path: Optional[str]):
+        """生成单个角色的单个非 neutral 表情"""
+        logger.info(f"         🎨 生成 {char_name} - {expr}...")
+        
+        # 让 Actor 描述这个表情
+        description = actor.generate_expression_description(expr)
+        additional_feedback = f"Expression description: {description}"
+        
+        # 使用审核循环生成
+        result_path = self._generate_expression_with_critique(
+            actor=actor,
+            expression=expr,
+            reference_image_path=ref_path,
+            additional_feedback=additional_feedback
+        )
+        
+        if result_path:
+            logger.info(f"         ✅ {char_name} - {expr} 生成完成")
+        else:
+            logger.error(f"         ❌ {char_name} - {expr} 生成失败")
 
     def _scan_story_for_expressions(self):
         """
@@ -483,9 +517,7 @@ class WorkflowController:
             
             # 提取所有 <image id="角色名">表情</image> 标签
             # 正则匹配：支持中文角色名
-            import re
-            pattern = r'<image\s+id="([^"]+)">([^<]+)</image>'
-            matches = re.findall(pattern, story_content)
+            matches = IMAGE_TAG_RE.findall(story_content)
             
             if not matches:
                 logger.info("   ℹ️ 剧本中没有找到角色表情标签")
@@ -543,220 +575,286 @@ class WorkflowController:
             node_summaries = {}
             node_contents = {}
             
-            for idx, node_id in enumerate(node_order, 1):
-                node_info = story_graph.get_node(node_id)
-                logger.info(f"\n📅 [{idx}/{len(node_order)}] 正在制作节点: {node_id}")
+            # 断点续写：已完成的节点一次性提取内容，并批量生成摘要
+            self._preload_existing_nodes(node_order, node_summaries, node_contents)
+            
+            # 按层级生成：同一层的节点互不依赖（父节点都在更早的层），可以并行创作
+            max_workers = max(1, WriterConfig.MAX_PARALLEL_NODES)
+            total = len(node_order)
+            idx = 0
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="node") as executor:
+                for level_nodes in self._group_nodes_by_level(node_order, story_graph):
+                    futures = []
+                    for node_id in level_nodes:
+                        idx += 1
+                        futures.append(executor.submit(
+                            self._generate_node_story, idx, total, node_id,
+                            story_graph, node_summaries, node_contents
+                        ))
+                    # 等待整层完成；任一节点失败则抛出，终止后续生成
+                    for future in futures:
+                        future.result()
+            
+            logger.info("\n🎉 完整故事生成完成！")
+            
+        except Exception as e:
+            logger.error(f"❌ 故事生成失败: {e}", exc_info=True)
+
+    def _preload_existing_nodes(
+        self,
+        node_order: List[str],
+        node_summaries: Dict[str, str],
+        node_contents: Dict[str, str]
+    ):
+        """
+        提取 story.txt 中已生成节点的内容，并批量生成摘要
+        
+        逐节点生成时每个已存在节点都要单独请求一次摘要，这里合并成少量批量请求
+        """
+        content = FileHelper.read_text_cached(PathConfig.STORY_FILE)
+        if not content:
+            return
+        
+        existing = []
+        for node_id in node_order:
+            if f"=== Node: {node_id} ===" not in content:
+                continue
+            match = re.search(f"=== Node: {re.escape(node_id)} ===(.*?)(=== Node|$)", content, re.DOTALL)
+            if match:
+                node_contents[node_id] = match.group(1).strip()
+                existing.append(node_id)
+        
+        if existing:
+            logger.info(f"⏭️ 检测到 {len(existing)} 个已生成的节点，批量生成摘要...")
+            summaries = self.writer.summarize_story_batch([node_contents[node_id] for node_id in existing])
+            node_summaries.update(zip(existing, summaries))
+
+    @staticmethod
+    def _group_nodes_by_level(node_order: List[str], story_graph: 'StoryGraph') -> List[List[str]]:
+        """
+        按依赖深度把拓扑序中的节点分层
+        
+        节点层级 = 所有父节点的最大层级 + 1，同层节点之间没有依赖关系
+        """
+        levels = {}
+        grouped = []
+        for node_id in node_order:
+            level = max((levels[p] + 1 for p in story_graph.get_parents(node_id) if p in levels), default=0)
+            levels[node_id] = level
+            if level == len(grouped):
+                grouped.append([])
+            grouped[level].append(node_id)
+        return grouped
+
+    def _generate_node_story(
+        self,
+        idx: int,
+        total: int,
+        node_id: str,
+        story_graph: 'StoryGraph',
+        node_summaries: Dict[str, str],
+        node_contents: Dict[str, str]
+    ):
+        """生成单个节点的剧情（父节点的摘要和内容须已在 node_summaries / node_contents 中）"""
+        node_info = story_graph.get_node(node_id)
+        logger.info(f"\n📅 [{idx}/{total}] 正在制作节点: {node_id}")
+        
+        # 已生成的节点由 _preload_existing_nodes 预先载入内容和摘要，断点续写时直接跳过
+        if node_id in node_contents:
+            logger.info(f"   ⏭️ 节点剧情已存在，跳过生成")
+            return
+        
+        # 构建上下文（支持多父节点）
+        parents = story_graph.get_parents(node_id)
+        
+        # 长期记忆：祖先节点摘要
+        long_term_memory = self._build_long_term_memory(
+            node_id, story_graph, node_summaries
+        )
+        
+        # 短期记忆：直接父节点的完整内容
+        short_term_memory = ""
+        if parents:
+            if len(parents) > 1:
+                # 汇合点：提示 LLM 有多条路径汇合
+                parent_summaries = [
+                    f"【路径{i+1}】{node_summaries.get(p, '(无摘要)')}" 
+                    for i, p in enumerate(parents) if p in node_summaries
+                ]
+                short_term_memory = (
+                    "多条剧情路径在此汇合，请基于公共记忆继续故事：\n" + 
+                    "\n".join(parent_summaries)
+                )
+            else:
+                # 普通节点：使用完整父节点内容
+                parent_contents = [node_contents.get(p, "") for p in parents if p in node_contents]
+                short_term_memory = "\n\n".join(parent_contents)
+        
+        full_context = f"{long_term_memory}\n\n【最近剧情】:\n{short_term_memory}"
+        
+        # 生成剧情
+        node_performance_data = []
+        plot_summary = node_info.get('summary', '')
+        
+        # 找出登场角色
+        char_names = list(self.actors.keys())
+        present_actors = list(self.actors.items())  # 直接用全体角色
+        
+        if present_actors:
+            # ==================== 第一步：拆分剧情片段 ====================
+            logger.info(f"✂️  正在切分节点 {node_id} 的剧情片段...")
+            available_scenes = [scene['name'] for scene in self.game_design.get('scenes', [])]
+            # 获取完整的角色信息
+            available_characters = self.game_design.get('characters', [])
+            
+            # 流式切分：第一个片段到达后即开始表演，其余片段在后台继续接收
+            plots = self.writer.stream_node_plots(
+                node_summary=plot_summary,
+                long_term_memory=long_term_memory,
+                available_scenes=available_scenes,
+                available_characters=available_characters,
+                segment_count=DesignerConfig.PLOT_SEGMENTS_PER_NODE
+            )
+            
+            first_plot = next(plots, None)
+            if first_plot is None:
+                logger.warning(f"⚠️ 节点 {node_id} 剧情切分失败，使用原始概要")
+                plots = iter([{"id": 1, "summary": plot_summary}])
+            else:
+                logger.info("✅ 首个剧情片段已就绪，开始表演")
+                plots = itertools.chain([first_plot], plots)
+            
+            # ==================== 第二步：对每个片段进行表演循环 ====================
+            all_plot_contexts = []
+            performance_log_path = os.path.join(PathConfig.TEXT_LOG_DIR, f"performance_{node_id}.jsonl")
+            
+            # 清理旧的表演日志（如果存在），确保重新生成时覆盖
+            if os.path.exists(performance_log_path):
+                FileHelper.close_append_stream(performance_log_path)
+                os.remove(performance_log_path)
+                logger.info(f"🗑️  已清理节点 {node_id} 的旧表演日志")
+            
+            for plot_idx, plot_info in enumerate(plots, 1):
+                plot_id = plot_info.get('id', plot_idx)
+                current_plot_summary = plot_info.get('summary', plot_summary)
                 
-                # 检查是否已存在
-                story_path = Path(PathConfig.STORY_FILE)
-                node_exists = False
-                if story_path.exists():
-                    with open(story_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        if f"=== Node: {node_id} ===" in content:
-                            node_exists = True
-                            logger.info(f"   ⏭️ 节点剧情已存在，跳过生成")
-                            
-                            # 提取内容用于上下文
-                            pattern = f"=== Node: {node_id} ===(.*?)(=== Node|$)"
-                            match = re.search(pattern, content, re.DOTALL)
-                            if match:
-                                node_content = match.group(1).strip()
-                                node_contents[node_id] = node_content
-                                if node_id not in node_summaries:
-                                    node_summary = self.writer.summarize_story(node_content)
-                                    node_summaries[node_id] = node_summary
+                logger.info(f"🎬 执行片段 {plot_idx}: {current_plot_summary[:50]}...")
                 
-                if not node_exists:
-                    # 构建上下文（支持多父节点）
-                    parents = story_graph.get_parents(node_id)
-                    
-                    # 长期记忆：祖先节点摘要
-                    long_term_memory = self._build_long_term_memory(
-                        node_id, story_graph, node_summaries
+                turn_count = 0
+                safety_limit = 50  # 安全限制固定为50轮
+                speaker_retry_count = 0  # 导演重试计数
+                max_speaker_retries = 3
+                
+                # 构建该片段的上下文：全局历史 + 前面的片段内容
+                previous_plots_context = "\n\n".join(all_plot_contexts) if all_plot_contexts else ""
+                plot_full_context = full_context
+                if previous_plots_context:
+                    plot_full_context += f"\n\n【前面的片段】:\n{previous_plots_context}"
+                
+                # 该片段的完整上下文只构建一次，之后每轮把表演追加到末尾，不再重新拼接整段对话
+                plot_context_prefix = f"{plot_full_context}\n\n【当前片段对话】:\n"
+                current_total_context = plot_context_prefix
+                
+                while turn_count < safety_limit:
+                    present_char_names = [name for name, _ in present_actors]
+                    # 从 ActorAgent 中提取角色信息字典
+                    present_char_info = [actor.character_info for _, actor in present_actors]
+                    next_speaker_name, plot_guidance = self.writer.decide_next_speaker(
+                        plot_summary=current_plot_summary,
+                        characters=present_char_info,
+                        story_context=current_total_context
                     )
                     
-                    # 短期记忆：直接父节点的完整内容
-                    short_term_memory = ""
-                    if parents:
-                        if len(parents) > 1:
-                            # 汇合点：提示 LLM 有多条路径汇合
-                            parent_summaries = [
-                                f"【路径{i+1}】{node_summaries.get(p, '(无摘要)')}" 
-                                for i, p in enumerate(parents) if p in node_summaries
-                            ]
-                            short_term_memory = (
-                                "多条剧情路径在此汇合，请基于公共记忆继续故事：\n" + 
-                                "\n".join(parent_summaries)
-                            )
+                    if "STOP" in next_speaker_name:
+                        logger.info(f"🎬 片段 {plot_idx} 的导演喊卡")
+                        break
+                    
+                    next_actor = None
+                    next_char_name = ""
+                    for name, agent in present_actors:
+                        if name in next_speaker_name or next_speaker_name in name:
+                            next_actor = agent
+                            next_char_name = name
+                            break
+                    
+                    if not next_actor:
+                        speaker_retry_count += 1
+                        logger.warning(f"⚠️ 导演指定了未知角色: {next_speaker_name}，重新指定发言者 (重试 {speaker_retry_count}/{max_speaker_retries})...")
+                        if speaker_retry_count < max_speaker_retries:
+                            # 继续循环，让导演重新决策
+                            continue
                         else:
-                            # 普通节点：使用完整父节点内容
-                            parent_contents = [node_contents.get(p, "") for p in parents if p in node_contents]
-                            short_term_memory = "\n\n".join(parent_contents)
+                            logger.warning(f"⚠️ 导演在 {max_speaker_retries} 次重试后仍未指定有效角色，结束本片段对话")
+                            break
                     
-                    full_context = f"{long_term_memory}\n\n【最近剧情】:\n{short_term_memory}"
+                    # 成功获取有效角色，重置重试计数
+                    speaker_retry_count = 0
                     
-                    # 生成剧情
-                    node_performance_data = []
-                    plot_summary = node_info.get('summary', '')
+                    # 构建其他角色的完整信息
+                    other_chars = [
+                        actor.character_info for char_name, actor in present_actors
+                        if char_name != next_char_name
+                    ]
+                    available_expressions = self._get_expressions_str(next_char_name)
                     
-                    # 找出登场角色
-                    char_names = list(self.actors.keys())
-                    present_actors = list(self.actors.items())  # 直接用全体角色
+                    enhanced_plot_summary = current_plot_summary
+                    if plot_guidance:
+                        enhanced_plot_summary += f"\n【导演指导】{plot_guidance}"
                     
-                    if present_actors:
-                        # ==================== 第一步：拆分剧情片段 ====================
-                        logger.info(f"✂️  正在切分节点 {node_id} 的剧情片段...")
-                        available_scenes = [scene['name'] for scene in self.game_design.get('scenes', [])]
-                        # 获取完整的角色信息
-                        available_characters = self.game_design.get('characters', [])
-                        
-                        plots = self.writer.split_node_into_plots(
-                            node_summary=plot_summary,
-                            long_term_memory=long_term_memory,
-                            available_scenes=available_scenes,
-                            available_characters=available_characters,
-                            segment_count=DesignerConfig.PLOT_SEGMENTS_PER_NODE
-                        )
-                        
-                        if not plots:
-                            logger.warning(f"⚠️ 节点 {node_id} 剧情切分失败，使用原始概要")
-                            plots = [{"id": 1, "summary": plot_summary}]
-                        
-                        logger.info(f"✅ 已切分为 {len(plots)} 个片段")
-                        
-                        # ==================== 第二步：对每个片段进行表演循环 ====================
-                        all_plot_contexts = []
-                        performance_log_path = os.path.join(PathConfig.TEXT_LOG_DIR, f"performance_{node_id}.jsonl")
-                        
-                        # 清理旧的表演日志（如果存在），确保重新生成时覆盖
-                        if os.path.exists(performance_log_path):
-                            os.remove(performance_log_path)
-                            logger.info(f"🗑️  已清理节点 {node_id} 的旧表演日志")
-                        
-                        for plot_idx, plot_info in enumerate(plots, 1):
-                            plot_id = plot_info.get('id', plot_idx)
-                            current_plot_summary = plot_info.get('summary', plot_summary)
-                            
-                            logger.info(f"🎬 执行片段 {plot_idx}/{len(plots)}: {current_plot_summary[:50]}...")
-                            
-                            # 该片段的对话累积缓冲
-                            plot_current_context = ""
-                            turn_count = 0
-                            safety_limit = 50  # 安全限制固定为50轮
-                            speaker_retry_count = 0  # 导演重试计数
-                            max_speaker_retries = 3
-                            
-                            # 构建该片段的上下文：全局历史 + 前面的片段内容
-                            previous_plots_context = "\n\n".join(all_plot_contexts) if all_plot_contexts else ""
-                            plot_full_context = full_context
-                            if previous_plots_context:
-                                plot_full_context += f"\n\n【前面的片段】:\n{previous_plots_context}"
-                            
-                            while turn_count < safety_limit:
-                                current_total_context = f"{plot_full_context}\n\n【当前片段对话】:\n{plot_current_context}"
-                                
-                                present_char_names = [name for name, _ in present_actors]
-                                # 从 ActorAgent 中提取角色信息字典
-                                present_char_info = [actor.character_info for _, actor in present_actors]
-                                next_speaker_name, plot_guidance = self.writer.decide_next_speaker(
-                                    plot_summary=current_plot_summary,
-                                    characters=present_char_info,
-                                    story_context=current_total_context
-                                )
-                                
-                                if "STOP" in next_speaker_name:
-                                    logger.info(f"🎬 片段 {plot_idx} 的导演喊卡")
-                                    break
-                                
-                                next_actor = None
-                                next_char_name = ""
-                                for name, agent in present_actors:
-                                    if name in next_speaker_name or next_speaker_name in name:
-                                        next_actor = agent
-                                        next_char_name = name
-                                        break
-                                
-                                if not next_actor:
-                                    speaker_retry_count += 1
-                                    logger.warning(f"⚠️ 导演指定了未知角色: {next_speaker_name}，重新指定发言者 (重试 {speaker_retry_count}/{max_speaker_retries})...")
-                                    if speaker_retry_count < max_speaker_retries:
-                                        # 继续循环，让导演重新决策
-                                        continue
-                                    else:
-                                        logger.warning(f"⚠️ 导演在 {max_speaker_retries} 次重试后仍未指定有效角色，结束本片段对话")
-                                        break
-                                
-                                # 成功获取有效角色，重置重试计数
-                                speaker_retry_count = 0
-                                
-                                # 构建其他角色的完整信息
-                                other_chars = [
-                                    actor.character_info for char_name, actor in present_actors
-                                    if char_name != next_char_name
-                                ]
-                                available_expressions = self._get_expressions_str(next_char_name)
-                                
-                                enhanced_plot_summary = current_plot_summary
-                                if plot_guidance:
-                                    enhanced_plot_summary += f"\n【导演指导】{plot_guidance}"
-                                
-                                performance = next_actor.perform_plot(
-                                    plot_summary=enhanced_plot_summary,
-                                    other_characters=other_chars,
-                                    story_context=current_total_context,
-                                    character_expressions=available_expressions
-                                )
-                                
-                                # 记录演员表演
-                                self._log_performance(performance_log_path, {
-                                    "node_id": node_id,
-                                    "plot_id": plot_id,
-                                    "character": next_char_name,
-                                    "content": performance
-                                })
-                                
-                                if performance.strip():
-                                    plot_current_context += f"{performance}\n"
-                                    self._update_character_expressions(next_char_name, performance)
-                                    turn_count += 1
-                                else:
-                                    break
-                            
-                            all_plot_contexts.append(plot_current_context)
-                            logger.info(f"✅ 片段 {plot_idx} 完成 ({turn_count} 轮对话)")
-                        
-                        # ==================== 第三步：整合所有片段成完整剧本 ====================
-                        logger.info(f"✍️  Writer 正在整合节点 {node_id} 的所有片段...")
-                        
-                        # 所有片段的完整对话
-                        current_context = "\n\n".join(all_plot_contexts)
-                        
-                        # 获取选项信息
-                        children = story_graph.get_children(node_id)
-                        choices_data = [{"target": child_id, "text": choice_text} for child_id, choice_text in children]
-                        
-                        # 调用 writer 润色整合
-                        polished_script = self.writer.synthesize_script(
-                            plot_performances=[{"content": current_context}],
-                            choices=choices_data,
-                            story_context=full_context,
-                            available_scenes=available_scenes,
-                            available_characters=available_characters
-                        )
-                        
-                        # 保存润色后的剧本
-                        self._save_node_story(node_id, polished_script)
-                        node_contents[node_id] = polished_script
-                        node_summary = self.writer.summarize_story(polished_script)
-                        node_summaries[node_id] = node_summary
+                    performance = next_actor.perform_plot(
+                        plot_summary=enhanced_plot_summary,
+                        other_characters=other_chars,
+                        story_context=current_total_context,
+                        character_expressions=available_expressions
+                    )
                     
-                    logger.info(f"✅ 节点 {node_id} 剧情生成完成")
+                    # 记录演员表演
+                    self._log_performance(performance_log_path, {
+                        "node_id": node_id,
+                        "plot_id": plot_id,
+                        "character": next_char_name,
+                        "content": performance
+                    })
+                    
+                    if performance.strip():
+                        current_total_context += f"{performance}\n"
+                        self._update_character_expressions(next_char_name, performance)
+                        turn_count += 1
+                    else:
+                        break
+                
+                all_plot_contexts.append(current_total_context[len(plot_context_prefix):])
+                logger.info(f"✅ 片段 {plot_idx} 完成 ({turn_count} 轮对话)")
             
-            logger.info("\n🎉 完整故事生成完成！")
+            FileHelper.close_append_stream(performance_log_path)
+            logger.info(f"✅ 节点 {node_id} 共表演 {len(all_plot_contexts)} 个片段")
             
-        except Exception as e:
-            logger.error(f"❌ 故事生成失败: {e}", exc_info=True)
+            # ==================== 第三步：整合所有片段成完整剧本 ====================
+            logger.info(f"✍️  Writer 正在整合节点 {node_id} 的所有片段...")
+            
+            # 所有片段的完整对话
+            current_context = "\n\n".join(all_plot_contexts)
+            
+            # 获取选项信息
+            children = story_graph.get_children(node_id)
+            choices_data = [{"target": child_id, "text": choice_text} for child_id, choice_text in children]
+            
+            # 调用 writer 润色整合
+            polished_script = self.writer.synthesize_script(
+                plot_performances=[{"content": current_context}],
+                choices=choices_data,
+                story_context=full_context,
+                available_scenes=available_scenes,
+                available_characters=available_characters
+            )
+            
+            # 保存润色后的剧本
+            self._save_node_story(node_id, polished_script)
+            node_contents[node_id] = polished_script
+            node_summary = self.writer.summarize_story(polished_script)
+            node_summaries[node_id] = node_summary
+        
+        logger.info(f"✅ 节点 {node_id} 剧情生成完成")
 
     def load_existing_game(self) -> bool:
         """加载已存在的游戏数据"""
@@ -813,24 +911,27 @@ class WorkflowController:
         Returns:
             新增的表情列表
         """
-        current_expressions = set(self._get_character_expressions(character_name))
-        new_expressions = [expr for expr in expressions if expr not in current_expressions]
-        
-        if new_expressions:
-            if character_name not in self.expressions_db:
-                self.expressions_db[character_name] = []
+        with self._expressions_lock:
+            current_expressions = set(self._get_character_expressions(character_name))
+            new_expressions = [expr for expr in expressions if expr not in current_expressions]
             
-            self.expressions_db[character_name].extend(new_expressions)
-            self.expressions_db[character_name] = list(set(self.expressions_db[character_name]))  # 去重
-            self._save_expressions()
+            if new_expressions:
+                if character_name not in self.expressions_db:
+                    self.expressions_db[character_name] = []
+                
+                self.expressions_db[character_name].extend(new_expressions)
+                self.expressions_db[character_name] = list(set(self.expressions_db[character_name]))  # 去重
+                self._save_expressions()
             
         return new_expressions
 
     def _update_character_expressions(self, character_name: str, text: str) -> List[str]:
         """从文本中提取表情标签，更新该角色的表情库"""
         # 提取所有 <image id="name">expression</image> 标签
-        pattern = rf'<image\s+id="{re.escape(character_name)}">([^<]+)</image>'
-        extracted_expressions = list(set(re.findall(pattern, text)))
+        extracted_expressions = list({
+            expression for name, expression in IMAGE_TAG_RE.findall(text)
+            if name == character_name
+        })
         
         if not extracted_expressions:
             return []
@@ -843,7 +944,6 @@ class WorkflowController:
     def _initialize_character_expressions(self, character_name: str):
         """初始化角色的表情库"""
         if character_name not in self.expressions_db:
-            from agents.config import STANDARD_EXPRESSIONS
             initial_expressions = STANDARD_EXPRESSIONS.copy()
             self.expressions_db[character_name] = initial_expressions
             self._save_expressions()
@@ -887,13 +987,11 @@ class WorkflowController:
         total_nodes = len(self.game_design.get("story_graph", {}).get("nodes", {}))
         completed_nodes = 0
         
-        story_path = Path(PathConfig.STORY_FILE)
-        if story_path.exists():
-            with open(story_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                for node_id in self.game_design.get("story_graph", {}).get("nodes", {}):
-                    if f"=== Node: {node_id} ===" in content:
-                        completed_nodes += 1
+        content = FileHelper.read_text_cached(PathConfig.STORY_FILE)
+        if content is not None:
+            for node_id in self.game_design.get("story_graph", {}).get("nodes", {}):
+                if f"=== Node: {node_id} ===" in content:
+                    completed_nodes += 1
         
         return {
             "initialized": True,
@@ -989,7 +1087,7 @@ class WorkflowController:
             content: 剧情内容
         """
         story_path = Path(PathConfig.STORY_FILE)
-        with open(story_path, 'a', encoding='utf-8') as f:
+        with self._story_lock, open(story_path, 'a', encoding='utf-8') as f:
             f.write(f"\n=== Node: {node_id} ===\n")
             f.write(content)
             f.write("\n")
@@ -1025,15 +1123,11 @@ class WorkflowController:
             data: 要记录的数据字典
         """
         try:
-            import json
-            from datetime import datetime
-            
             # 添加简洁时间戳（HH:MM:SS格式）
             data['timestamp'] = datetime.now().strftime("%H:%M:%S")
             
-            # 追加到 jsonl 文件
-            with open(log_path, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(data, ensure_ascii=False) + '\n')
+            # 追加到 jsonl 文件（复用常驻句柄，每轮对话不再重新打开文件）
+            FileHelper.append_text_stream(log_path, json.dumps(data, ensure_ascii=False) + '\n')
         except Exception as e:
             logger.warning(f"⚠️ 记录表演日志失败: {e}")
     